@@ -2,10 +2,11 @@ import flet as ft
 import threading
 import time
 import os
-from datetime import datetime
+from datetime import datetime, timedelta
 import sqlite3
-from typing import List, Dict, Optional, Tuple
+from typing import List, Dict, Optional, Tuple, Callable, Iterable, Iterator
 import hashlib
+import zlib
 import logging
 import requests
 import json
@@ -21,6 +22,13 @@ import uuid
 import tempfile
 import inspect
 import shutil
+import queue
+import itertools
+import random
+from urllib.parse import urlparse
+from email.utils import parsedate_to_datetime
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
 
 # Variable global para la instancia de base de datos
 # Variable global para la instancia de base de datos y su ruta
@@ -30,6 +38,56 @@ extractor_thread = None
 descargador_thread = None
 stop_extraction = False
 stop_download = False
+MATERIAS_CACHE = {}
+materias_cache_lock = threading.Lock()
+CAPAS_BD = {}
+capas_bd_lock = threading.Lock()
+CLIENTE_HTTP = None
+cliente_http_lock = threading.Lock()
+REINTENTOS_HTTP = 4
+BACKOFF_BASE = 1.0
+BACKOFF_MAXIMO = 30.0
+# Peticiones por segundo a la SCJN; sin un máximo explícito, la tasa configurada es el techo del AIMD
+PETICIONES_POR_SEGUNDO = 4.0
+PETICIONES_POR_SEGUNDO_MIN = 0.2
+WORKERS_DETALLES = 16
+COMBINACIONES_CONCURRENTES = 4
+CAPACIDAD_COLAS_PIPELINE = 8
+PAGINAS_EN_VUELO_POR_COMBINACION = 2
+HILOS_PAGINAS_POR_COMBINACION = 2
+DOCS_POR_COMMIT = 200
+MS_POR_COMMIT = 500
+WORKERS_DESCARGA = 8
+INTERVALO_PROGRESO_DESCARGA = 0.25
+TAMANO_BLOQUE_DESCARGA = 64 * 1024
+BACKOFF_DESCARGA_BASE = 15 * 60
+BACKOFF_DESCARGA_MAXIMO = 7 * 24 * 3600
+STATUS_DESCARGA_PERMANENTES = (404, 410)
+LOTE_PENDIENTES_DESCARGA = 1000
+# Subirla al cambiar el parseo cambia los hashes y obliga a reescribir las tesis
+VERSION_PARSER = 1
+MODOS_CACHE = ('desactivado', 'grabar', 'reproducir')
+RESPUESTAS_CACHE_POR_COMMIT = 200
+MS_POR_COMMIT_CACHE = 2000
+UMBRAL_SYNC_SIN_CAMBIOS = 100
+# Columnas del CSV; las de control interno (hashes, reintentos) quedan fuera
+COLUMNAS_EXPORTACION_TESIS = [
+    'ius', 'id', 'rubro', 'clave_tesis', 'localizacion', 'sala', 'epoca', 'instancia', 'fuente',
+    'tipo_tesis', 'tipo_jurisprudencia', 'tipo_jurisprudencia_texto', 'precedentes', 'ejecutorias',
+    'votos', 'volumen', 'tomo', 'pagina', 'mes', 'anio', 'epoca_config', 'tipo_tesis_config',
+    'fecha_extraccion', 'fecha_actualizacion', 'descargado', 'ubicacion'
+]
+# Tablas resumen_* mantenidas por triggers: (tabla, columna de la tabla resumen, columna de tesis)
+RESUMENES_TESIS = [
+    ('resumen_epoca', 'epoca', 'epoca_config'),
+    ('resumen_tipo_tesis', 'tipo_tesis', 'tipo_tesis_config'),
+    ('resumen_sala', 'sala', 'sala'),
+    ('resumen_tipo_jurisprudencia', 'tipo_jurisprudencia', 'tipo_jurisprudencia_texto'),
+]
+
+def hash_payload(datos) -> str:
+    normalizado = json.dumps(datos, sort_keys=True, ensure_ascii=False, separators=(',', ':'), default=str)
+    return hashlib.sha1(normalizado.encode('utf-8')).hexdigest()
 
 def resource_path(relative_path):
     try:
@@ -70,25 +128,286 @@ def ensure_db_in_data(data_dir):
 
 
 
+class TareaEscritura:
+    def __init__(self, operacion: Callable):
+        self.operacion = operacion
+        self.resultado = None
+        self.error = None
+        self.hecha = threading.Event()
+
+
+class EscritorBD:
+    def __init__(self, db_path: str, max_lote: int = 500):
+        self.db_path = db_path
+        self.max_lote = max_lote
+        self._cola = queue.Queue()
+        self._cerrado = False
+        self._conn = sqlite3.connect(db_path, timeout=30, check_same_thread=False, isolation_level=None)
+        self._conn.row_factory = sqlite3.Row
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA cache_size = -20000")
+        self._cursor = self._conn.cursor()
+        self._hilo = threading.Thread(target=self._ciclo, daemon=True, name="EscritorBD")
+        self._hilo.start()
+
+    def ejecutar(self, operacion: Callable):
+        if threading.current_thread() is self._hilo:
+            return operacion(self._cursor)
+        if self._cerrado:
+            raise sqlite3.ProgrammingError("El escritor de la base de datos está cerrado")
+        tarea = TareaEscritura(operacion)
+        self._cola.put(tarea)
+        tarea.hecha.wait()
+        if tarea.error is not None:
+            raise tarea.error
+        return tarea.resultado
+
+    def cerrar(self):
+        if self._cerrado:
+            return
+        self._cerrado = True
+        self._cola.put(None)
+        self._hilo.join()
+
+    def _ciclo(self):
+        terminar = False
+        while not terminar:
+            tarea = self._cola.get()
+            if tarea is None:
+                break
+            lote = [tarea]
+            while len(lote) < self.max_lote:
+                try:
+                    siguiente = self._cola.get_nowait()
+                except queue.Empty:
+                    break
+                if siguiente is None:
+                    terminar = True
+                    break
+                lote.append(siguiente)
+            self._procesar_lote(lote)
+        self._conn.close()
+
+    def _procesar_lote(self, lote: List[TareaEscritura]):
+        cursor = self._cursor
+        try:
+            cursor.execute("BEGIN IMMEDIATE")
+            for tarea in lote:
+                cursor.execute("SAVEPOINT tarea")
+                try:
+                    tarea.resultado = tarea.operacion(cursor)
+                    cursor.execute("RELEASE tarea")
+                except Exception as e:
+                    tarea.error = e
+                    cursor.execute("ROLLBACK TO tarea")
+                    cursor.execute("RELEASE tarea")
+            cursor.execute("COMMIT")
+        except Exception as e:
+            logging.error(f"Error al confirmar lote de {len(lote)} escrituras: {e}")
+            if self._conn.in_transaction:
+                self._conn.rollback()
+            for tarea in lote:
+                if tarea.error is None:
+                    tarea.error = e
+                    tarea.resultado = None
+        finally:
+            for tarea in lote:
+                tarea.hecha.set()
+
+
+class PoolLectores:
+    def __init__(self, db_path: str, tamano: int = 4):
+        self._uri = Path(db_path).resolve().as_uri() + "?mode=ro"
+        self.tamano = tamano
+        self._libres = queue.LifoQueue()
+        self._creadas = 0
+        self._lock = threading.Lock()
+
+    def _abrir(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self._uri, uri=True, timeout=30, check_same_thread=False, isolation_level=None)
+        conn.row_factory = sqlite3.Row
+        conn.execute("PRAGMA cache_size = -20000")
+        return conn
+
+    @contextmanager
+    def conexion(self):
+        try:
+            conn = self._libres.get_nowait()
+        except queue.Empty:
+            with self._lock:
+                crear = self._creadas < self.tamano
+                if crear:
+                    self._creadas += 1
+            if crear:
+                try:
+                    conn = self._abrir()
+                except Exception:
+                    with self._lock:
+                        self._creadas -= 1
+                    raise
+            else:
+                conn = self._libres.get()
+        try:
+            yield conn
+        finally:
+            self._libres.put(conn)
+
+    def cerrar(self):
+        while True:
+            try:
+                self._libres.get_nowait().close()
+            except queue.Empty:
+                break
+
+
+class CapaBD:
+    def __init__(self, db_path: str, lectores: int = 4):
+        self.escritor = EscritorBD(db_path)
+        self.lectores = PoolLectores(db_path, lectores)
+
+    def cerrar(self):
+        self.escritor.cerrar()
+        self.lectores.cerrar()
+
+
+def obtener_capa_bd(db_path: str) -> CapaBD:
+    clave = os.path.abspath(db_path)
+    with capas_bd_lock:
+        capa = CAPAS_BD.get(clave)
+        if capa is None:
+            capa = CapaBD(db_path)
+            CAPAS_BD[clave] = capa
+        return capa
+
+
+def cerrar_capas_bd():
+    with capas_bd_lock:
+        capas = list(CAPAS_BD.values())
+        CAPAS_BD.clear()
+    for capa in capas:
+        capa.cerrar()
+
+
 class SCJNTesisDatabase:
-    def __init__(self, db_path: str):
+    def __init__(self, db_path: str, preparar_esquema: bool = True):
         self.db_path = db_path
-        self.conn = None
-        self.cursor = None
+        self.capa = None
         self.connect()
-        self.create_tables()
-        self.migrar_datos_existentes()
+        if preparar_esquema:
+            self.preparar_esquema()
+
+    @classmethod
+    def conexion_rapida(cls, db_path: str) -> 'SCJNTesisDatabase':
+        return cls(db_path, preparar_esquema=False)
 
     def connect(self):
-        self.conn = sqlite3.connect(self.db_path, check_same_thread=False)
-        self.conn.row_factory = sqlite3.Row
-        self.cursor = self.conn.cursor()
-        self.cursor.execute("PRAGMA journal_mode=WAL")
-        self.cursor.execute("PRAGMA cache_size = -20000")
+        self.capa = obtener_capa_bd(self.db_path)
+
+    @contextmanager
+    def _lectura(self):
+        with self.capa.lectores.conexion() as conn:
+            yield conn.cursor()
+
+    def _escribir(self, operacion: Callable):
+        return self.capa.escritor.ejecutar(operacion)
+
+    def _migraciones(self) -> List:
+        # La posición + 1 de cada paso es el PRAGMA user_version que deja la base
+        return [
+            self._migracion_esquema_base,
+            self._migracion_hashes,
+            self._migracion_variantes_detalle,
+            self._migracion_estado_descargas,
+            self._migracion_indice_pendientes,
+            self._migracion_version_filtros,
+            self._migracion_fecha_fallo_descarga,
+        ]
+
+    def version_esquema(self) -> int:
+        with self._lectura() as cursor:
+            cursor.execute("PRAGMA user_version")
+            return cursor.fetchone()[0]
+
+    def preparar_esquema(self):
+        if self.version_esquema() >= len(self._migraciones()):
+            return
+        self._escribir(self._aplicar_migraciones)
+
+    def _aplicar_migraciones(self, cursor: sqlite3.Cursor):
+        cursor.execute("PRAGMA user_version")
+        version = cursor.fetchone()[0]
+        for numero, migracion in enumerate(self._migraciones()[version:], start=version + 1):
+            logging.info(f"Aplicando migración de esquema {numero}...")
+            migracion(cursor)
+            cursor.execute(f"PRAGMA user_version = {numero}")
+
+    def _migracion_esquema_base(self, cursor: sqlite3.Cursor):
+        self.create_tables(cursor)
+        self.migrar_datos_existentes(cursor)
+
+    def _migracion_hashes(self, cursor: sqlite3.Cursor):
+        self._asegurar_columna(cursor, 'tesis', 'hash_contenido', 'TEXT')
+        self._asegurar_columna(cursor, 'tesis', 'hash_detalle', 'TEXT')
+
+    def _migracion_variantes_detalle(self, cursor: sqlite3.Cursor):
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS variantes_detalle (
+                clave TEXT PRIMARY KEY,
+                exitos_normal INTEGER DEFAULT 0,
+                exitos_semanal INTEGER DEFAULT 0,
+                consultas INTEGER DEFAULT 0,
+                aciertos INTEGER DEFAULT 0,
+                fecha_actualizacion TEXT
+            )
+        ''')
+
+    def _migracion_estado_descargas(self, cursor: sqlite3.Cursor):
+        self._asegurar_columna(cursor, 'tesis', 'intentos_descarga', 'INTEGER DEFAULT 0')
+        self._asegurar_columna(cursor, 'tesis', 'ultimo_error', 'TEXT')
+        self._asegurar_columna(cursor, 'tesis', 'ultimo_status_http', 'INTEGER')
+        self._asegurar_columna(cursor, 'tesis', 'proximo_reintento', 'TEXT')
+        self._asegurar_columna(cursor, 'tesis', 'aparcada', 'INTEGER DEFAULT 0')
+
+    def _migracion_indice_pendientes(self, cursor: sqlite3.Cursor):
+        cursor.execute('''
+            CREATE INDEX IF NOT EXISTS idx_tesis_pendientes_descarga
+            ON tesis(ius) WHERE descargado = 'No'
+        ''')
+
+    def _migracion_fecha_fallo_descarga(self, cursor: sqlite3.Cursor):
+        self._asegurar_columna(cursor, 'tesis', 'fecha_ultimo_fallo', 'TEXT')
+
+    def _migracion_version_filtros(self, cursor: sqlite3.Cursor):
+        # Los cambios de materias y de columnas buscables también alteran los totales filtrados
+        subir_version = "UPDATE contadores SET valor = valor + 1 WHERE clave = 'version';"
+        cursor.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS tesis_materia_version_ai AFTER INSERT ON tesis_materia BEGIN
+                {subir_version}
+            END;
+        ''')
+        cursor.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS tesis_materia_version_ad AFTER DELETE ON tesis_materia BEGIN
+                {subir_version}
+            END;
+        ''')
+        cursor.execute("DROP TRIGGER IF EXISTS tesis_fts_au")
+        cursor.execute(f'''
+            CREATE TRIGGER tesis_fts_au
+            AFTER UPDATE OF rubro, clave_tesis, ius, epoca_config ON tesis
+            WHEN old.rubro IS NOT new.rubro OR old.clave_tesis IS NOT new.clave_tesis
+                 OR old.ius IS NOT new.ius OR old.epoca_config IS NOT new.epoca_config
+            BEGIN
+                INSERT INTO tesis_fts(tesis_fts, rowid, ius, rubro, clave_tesis, epoca_config)
+                VALUES('delete', old.rowid, old.ius, old.rubro, old.clave_tesis, old.epoca_config);
+                INSERT INTO tesis_fts(rowid, ius, rubro, clave_tesis, epoca_config)
+                VALUES (new.rowid, new.ius, new.rubro, new.clave_tesis, new.epoca_config);
+                {subir_version}
+            END;
+        ''')
 
-    def create_tables(self):
+    def create_tables(self, cursor: sqlite3.Cursor):
         try:
-            self.cursor.execute('''
+            cursor.execute('''
                 CREATE TABLE IF NOT EXISTS tesis (
                     ius TEXT PRIMARY KEY,
                     id TEXT,
@@ -116,16 +435,17 @@ class SCJNTesisDatabase:
                     fecha_actualizacion TEXT,
                     descargado TEXT DEFAULT 'No',
                     ubicacion TEXT,
+                    materias_texto TEXT,
                     UNIQUE(ius)
                 )
             ''')
-            self.cursor.execute('''
+            cursor.execute('''
                 CREATE TABLE IF NOT EXISTS materia (
                     id INTEGER PRIMARY KEY AUTOINCREMENT,
                     nombre TEXT UNIQUE NOT NULL
                 )
             ''')
-            self.cursor.execute('''
+            cursor.execute('''
                 CREATE TABLE IF NOT EXISTS tesis_materia (
                     tesis_ius TEXT NOT NULL,
                     materia_id INTEGER NOT NULL,
@@ -134,7 +454,7 @@ class SCJNTesisDatabase:
                     FOREIGN KEY (materia_id) REFERENCES materia(id) ON DELETE CASCADE
                 )
             ''')
-            self.cursor.execute('''
+            cursor.execute('''
                 CREATE TABLE IF NOT EXISTS control_extracciones (
                     id INTEGER PRIMARY KEY AUTOINCREMENT,
                     epoca TEXT,
@@ -148,55 +468,61 @@ class SCJNTesisDatabase:
                     UNIQUE(epoca, tipo_tesis, pagina)
                 )
             ''')
-            self.cursor.execute('''
+            cursor.execute('''
                 CREATE TABLE IF NOT EXISTS resumen_epoca (
                     epoca TEXT PRIMARY KEY,
                     cantidad INTEGER DEFAULT 0,
                     fecha_actualizacion TEXT
                 )
             ''')
-            self.cursor.execute('''
+            cursor.execute('''
                 CREATE TABLE IF NOT EXISTS resumen_tipo_tesis (
                     tipo_tesis TEXT PRIMARY KEY,
                     cantidad INTEGER DEFAULT 0,
                     fecha_actualizacion TEXT
                 )
             ''')
-            self.cursor.execute('''
+            cursor.execute('''
                 CREATE TABLE IF NOT EXISTS resumen_sala (
                     sala TEXT PRIMARY KEY,
                     cantidad INTEGER DEFAULT 0,
                     fecha_actualizacion TEXT
                 )
             ''')
-            self.cursor.execute('''
+            cursor.execute('''
                 CREATE TABLE IF NOT EXISTS resumen_tipo_jurisprudencia (
                     tipo_jurisprudencia TEXT PRIMARY KEY,
                     cantidad INTEGER DEFAULT 0,
                     fecha_actualizacion TEXT
                 )
             ''')
-            self.cursor.execute('''
+            cursor.execute('''
                 CREATE TABLE IF NOT EXISTS resumen_materia (
                     materia TEXT PRIMARY KEY,
                     cantidad INTEGER DEFAULT 0,
                     fecha_actualizacion TEXT
                 )
             ''')
-            self.cursor.execute('CREATE INDEX IF NOT EXISTS idx_tesis_ius ON tesis(ius)')
-            self.cursor.execute('CREATE INDEX IF NOT EXISTS idx_tesis_descargado ON tesis(descargado)')
-            self.cursor.execute('CREATE INDEX IF NOT EXISTS idx_tesis_epoca_config ON tesis(epoca_config)')
-            self.cursor.execute('''
-                CREATE INDEX IF NOT EXISTS idx_tesis_fecha_ius 
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS contadores (
+                    clave TEXT PRIMARY KEY,
+                    valor INTEGER DEFAULT 0
+                )
+            ''')
+            cursor.execute('CREATE INDEX IF NOT EXISTS idx_tesis_ius ON tesis(ius)')
+            cursor.execute('CREATE INDEX IF NOT EXISTS idx_tesis_descargado ON tesis(descargado)')
+            cursor.execute('CREATE INDEX IF NOT EXISTS idx_tesis_epoca_config ON tesis(epoca_config)')
+            cursor.execute('''
+                CREATE INDEX IF NOT EXISTS idx_tesis_fecha_ius
                 ON tesis(fecha_actualizacion DESC, ius DESC)
             ''')
-            self.cursor.execute('CREATE INDEX IF NOT EXISTS idx_tesis_rubro ON tesis(rubro)')
-            self.cursor.execute('CREATE INDEX IF NOT EXISTS idx_tesis_clave_tesis ON tesis(clave_tesis)')
-            self.cursor.execute('CREATE INDEX IF NOT EXISTS idx_tesis_sala ON tesis(sala)')
-            self.cursor.execute('CREATE INDEX IF NOT EXISTS idx_tesis_materia_tesis_ius ON tesis_materia(tesis_ius)')
-            self.cursor.execute('CREATE INDEX IF NOT EXISTS idx_tesis_materia_materia_id ON tesis_materia(materia_id)')
-            self.cursor.execute('CREATE INDEX IF NOT EXISTS idx_materia_nombre ON materia(nombre)')
-            self.cursor.execute('''
+            cursor.execute('CREATE INDEX IF NOT EXISTS idx_tesis_rubro ON tesis(rubro)')
+            cursor.execute('CREATE INDEX IF NOT EXISTS idx_tesis_clave_tesis ON tesis(clave_tesis)')
+            cursor.execute('CREATE INDEX IF NOT EXISTS idx_tesis_sala ON tesis(sala)')
+            cursor.execute('CREATE INDEX IF NOT EXISTS idx_tesis_materia_tesis_ius ON tesis_materia(tesis_ius)')
+            cursor.execute('CREATE INDEX IF NOT EXISTS idx_tesis_materia_materia_id ON tesis_materia(materia_id)')
+            cursor.execute('CREATE INDEX IF NOT EXISTS idx_materia_nombre ON materia(nombre)')
+            cursor.execute('''
                 CREATE VIRTUAL TABLE IF NOT EXISTS tesis_fts USING fts5(
                     ius,
                     rubro,
@@ -207,205 +533,415 @@ class SCJNTesisDatabase:
                     tokenize = 'unicode61 remove_diacritics 2'
                 )
             ''')
-            self.cursor.execute('''
+            cursor.execute('''
                 CREATE TRIGGER IF NOT EXISTS tesis_ai AFTER INSERT ON tesis BEGIN
                     INSERT INTO tesis_fts(rowid, ius, rubro, clave_tesis, epoca_config)
                     VALUES (new.rowid, new.ius, new.rubro, new.clave_tesis, new.epoca_config);
                 END;
             ''')
-            self.cursor.execute('''
-                CREATE TRIGGER IF NOT EXISTS tesis_au AFTER UPDATE ON tesis BEGIN
+            cursor.execute("DROP TRIGGER IF EXISTS tesis_au")
+            cursor.execute('''
+                CREATE TRIGGER IF NOT EXISTS tesis_fts_au
+                AFTER UPDATE OF rubro, clave_tesis, ius, epoca_config ON tesis
+                WHEN old.rubro IS NOT new.rubro OR old.clave_tesis IS NOT new.clave_tesis
+                     OR old.ius IS NOT new.ius OR old.epoca_config IS NOT new.epoca_config
+                BEGIN
                     INSERT INTO tesis_fts(tesis_fts, rowid, ius, rubro, clave_tesis, epoca_config)
                     VALUES('delete', old.rowid, old.ius, old.rubro, old.clave_tesis, old.epoca_config);
                     INSERT INTO tesis_fts(rowid, ius, rubro, clave_tesis, epoca_config)
                     VALUES (new.rowid, new.ius, new.rubro, new.clave_tesis, new.epoca_config);
                 END;
             ''')
-            self.cursor.execute('''
+            cursor.execute('''
                 CREATE TRIGGER IF NOT EXISTS tesis_ad AFTER DELETE ON tesis BEGIN
                     INSERT INTO tesis_fts(tesis_fts, rowid, ius, rubro, clave_tesis, epoca_config)
                     VALUES('delete', old.rowid, old.ius, old.rubro, old.clave_tesis, old.epoca_config);
                 END;
             ''')
-            self.conn.commit()
-            self._populate_fts_if_needed()
+            recontar = (not self._trigger_existe(cursor, 'tesis_resumen_ai')
+                        or not self._trigger_existe(cursor, 'tesis_contadores_ai'))
+            self._crear_triggers_resumen(cursor)
+            self._crear_triggers_contadores(cursor)
+            if self._asegurar_columna(cursor, 'tesis', 'materias_texto', 'TEXT'):
+                self._rellenar_materias_texto(cursor)
+            self._populate_fts_if_needed(cursor)
+            if recontar:
+                self._reconstruir_resumenes(cursor)
         except Exception as e:
             logging.error(f"Error al crear tablas: {e}")
             raise
 
-    def _populate_fts_if_needed(self):
-        self.cursor.execute("SELECT COUNT(*) FROM tesis_fts")
-        if self.cursor.fetchone()[0] == 0:
-            self.cursor.execute('''
+    def _trigger_existe(self, cursor: sqlite3.Cursor, nombre: str) -> bool:
+        cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'trigger' AND name = ?", (nombre,))
+        return cursor.fetchone() is not None
+
+    def _crear_triggers_contadores(self, cursor: sqlite3.Cursor):
+        def sumar(deltas):
+            casos = ' '.join(f"WHEN '{clave}' THEN {delta}" for clave, delta in deltas.items())
+            claves = ', '.join(f"'{clave}'" for clave in deltas)
+            return f"UPDATE contadores SET valor = valor + CASE clave {casos} END WHERE clave IN ({claves});"
+
+        cursor.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS tesis_contadores_ai AFTER INSERT ON tesis BEGIN
+                {sumar({'total_tesis': 1, 'tesis_descargadas': "(new.descargado IS 'Sí')", 'version': 1})}
+            END;
+        ''')
+        cursor.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS tesis_contadores_ad AFTER DELETE ON tesis BEGIN
+                {sumar({'total_tesis': -1, 'tesis_descargadas': "-(old.descargado IS 'Sí')", 'version': 1})}
+            END;
+        ''')
+        cursor.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS tesis_contadores_au AFTER UPDATE OF descargado ON tesis
+            WHEN old.descargado IS NOT new.descargado BEGIN
+                {sumar({'tesis_descargadas': "(new.descargado IS 'Sí') - (old.descargado IS 'Sí')", 'version': 1})}
+            END;
+        ''')
+        cursor.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS control_extracciones_contadores_ai AFTER INSERT ON control_extracciones BEGIN
+                {sumar({'paginas_procesadas': "(new.estado IS 'completada')", 'version': 1})}
+            END;
+        ''')
+        cursor.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS control_extracciones_contadores_ad AFTER DELETE ON control_extracciones BEGIN
+                {sumar({'paginas_procesadas': "-(old.estado IS 'completada')", 'version': 1})}
+            END;
+        ''')
+        cursor.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS control_extracciones_contadores_au AFTER UPDATE OF estado ON control_extracciones
+            WHEN old.estado IS NOT new.estado BEGIN
+                {sumar({'paginas_procesadas': "(new.estado IS 'completada') - (old.estado IS 'completada')", 'version': 1})}
+            END;
+        ''')
+
+    def _crear_triggers_resumen(self, cursor: sqlite3.Cursor):
+        def incrementar(tabla, clave, valor):
+            return f'''
+                INSERT INTO {tabla} ({clave}, cantidad, fecha_actualizacion)
+                SELECT {valor}, 1, datetime('now', 'localtime') WHERE {valor} IS NOT NULL AND {valor} != ''
+                ON CONFLICT({clave}) DO UPDATE SET
+                    cantidad = cantidad + 1, fecha_actualizacion = excluded.fecha_actualizacion;
+            '''
+
+        def decrementar(tabla, clave, valor):
+            return f'''
+                UPDATE {tabla} SET cantidad = cantidad - 1, fecha_actualizacion = datetime('now', 'localtime')
+                WHERE {clave} = {valor};
+                DELETE FROM {tabla} WHERE {clave} = {valor} AND cantidad <= 0;
+            '''
+
+        altas = ''.join(incrementar(tabla, clave, f"new.{col}") for tabla, clave, col in RESUMENES_TESIS)
+        bajas = ''.join(decrementar(tabla, clave, f"old.{col}") for tabla, clave, col in RESUMENES_TESIS)
+        cursor.execute(f"CREATE TRIGGER IF NOT EXISTS tesis_resumen_ai AFTER INSERT ON tesis BEGIN {altas} END;")
+        cursor.execute(f"CREATE TRIGGER IF NOT EXISTS tesis_resumen_ad AFTER DELETE ON tesis BEGIN {bajas} END;")
+        for tabla, clave, col in RESUMENES_TESIS:
+            cursor.execute(f'''
+                CREATE TRIGGER IF NOT EXISTS tesis_{tabla}_au AFTER UPDATE OF {col} ON tesis
+                WHEN old.{col} IS NOT new.{col} BEGIN
+                    {decrementar(tabla, clave, f"old.{col}")}
+                    {incrementar(tabla, clave, f"new.{col}")}
+                END;
+            ''')
+        materia_nueva = "(SELECT nombre FROM materia WHERE id = new.materia_id)"
+        materia_vieja = "(SELECT nombre FROM materia WHERE id = old.materia_id)"
+        cursor.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS tesis_materia_resumen_ai AFTER INSERT ON tesis_materia BEGIN
+                {incrementar('resumen_materia', 'materia', materia_nueva)}
+            END;
+        ''')
+        cursor.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS tesis_materia_resumen_ad AFTER DELETE ON tesis_materia BEGIN
+                {decrementar('resumen_materia', 'materia', materia_vieja)}
+            END;
+        ''')
+
+    def _asegurar_columna(self, cursor: sqlite3.Cursor, tabla: str, columna: str, definicion: str) -> bool:
+        cursor.execute(f"PRAGMA table_info({tabla})")
+        if columna in [col[1] for col in cursor.fetchall()]:
+            return False
+        cursor.execute(f"ALTER TABLE {tabla} ADD COLUMN {columna} {definicion}")
+        return True
+
+    def _rellenar_materias_texto(self, cursor: sqlite3.Cursor):
+        cursor.execute('''
+            UPDATE tesis SET materias_texto = (
+                SELECT GROUP_CONCAT(m.nombre, ', ')
+                FROM tesis_materia tm
+                JOIN materia m ON tm.materia_id = m.id
+                WHERE tm.tesis_ius = tesis.ius
+            )
+            WHERE EXISTS (SELECT 1 FROM tesis_materia tm WHERE tm.tesis_ius = tesis.ius)
+        ''')
+
+    def _populate_fts_if_needed(self, cursor: sqlite3.Cursor):
+        cursor.execute("SELECT COUNT(*) FROM tesis_fts")
+        if cursor.fetchone()[0] == 0:
+            cursor.execute('''
                 INSERT INTO tesis_fts(rowid, ius, rubro, clave_tesis, epoca_config)
                 SELECT rowid, ius, rubro, clave_tesis, epoca_config FROM tesis
             ''')
-            self.conn.commit()
 
-    def migrar_datos_existentes(self):
-        self.cursor.execute("PRAGMA table_info(tesis)")
-        columnas = [col[1] for col in self.cursor.fetchall()]
+    def migrar_datos_existentes(self, cursor: sqlite3.Cursor):
+        cursor.execute("PRAGMA table_info(tesis)")
+        columnas = [col[1] for col in cursor.fetchall()]
         tiene_columna_materias = 'materias' in columnas
-        self.cursor.execute("SELECT COUNT(*) FROM tesis")
-        total_tesis = self.cursor.fetchone()[0]
+        cursor.execute("SELECT COUNT(*) FROM tesis")
+        total_tesis = cursor.fetchone()[0]
         if total_tesis == 0:
             return
-        self.cursor.execute("SELECT COUNT(*) FROM resumen_epoca")
-        resumenes_existentes = self.cursor.fetchone()[0] > 0
+        cursor.execute("SELECT COUNT(*) FROM resumen_epoca")
+        resumenes_existentes = cursor.fetchone()[0] > 0
         if tiene_columna_materias and not resumenes_existentes:
             logging.info("Migrando datos existentes al nuevo esquema...")
-            self.cursor.execute("SELECT ius, materias FROM tesis WHERE materias IS NOT NULL AND materias != ''")
-            tesis_con_materias = self.cursor.fetchall()
-            for ius, materias_str in tesis_con_materias:
-                self._asignar_materias_a_tesis(ius, materias_str)
-            self.actualizar_resumenes()
+            cursor.execute("SELECT ius, materias FROM tesis WHERE materias IS NOT NULL AND materias != ''")
+            tesis_con_materias = cursor.fetchall()
+            self._asignar_materias_lote(cursor, [(ius, materias_str) for ius, materias_str in tesis_con_materias])
+            self._reconstruir_resumenes(cursor)
             logging.info("Migración completada.")
             return
         if not tiene_columna_materias and not resumenes_existentes:
-            logging.info("Actualizando tablas de resumen...")
-            self.actualizar_resumenes()
+            logging.info("Reconstruyendo tablas de resumen...")
+            self._reconstruir_resumenes(cursor)
             return
 
-    def _get_or_create_materia(self, nombre: str) -> Optional[int]:
+    def _cache_materias(self, cursor: sqlite3.Cursor) -> Dict[str, int]:
+        with materias_cache_lock:
+            cache = MATERIAS_CACHE.get(self.db_path)
+            if cache is None:
+                cursor.execute("SELECT nombre, id FROM materia")
+                cache = {row[0]: row[1] for row in cursor.fetchall()}
+                MATERIAS_CACHE[self.db_path] = cache
+            return cache
+
+    def _invalidar_cache_materias(self):
+        with materias_cache_lock:
+            MATERIAS_CACHE.pop(self.db_path, None)
+
+    def _get_or_create_materia(self, cursor: sqlite3.Cursor, nombre: str) -> Optional[int]:
         nombre = nombre.strip()
         if not nombre:
             return None
-        self.cursor.execute("SELECT id FROM materia WHERE nombre = ?", (nombre,))
-        row = self.cursor.fetchone()
-        if row:
-            return row[0]
-        self.cursor.execute("INSERT INTO materia (nombre) VALUES (?)", (nombre,))
-        self.conn.commit()
-        return self.cursor.lastrowid
+        return self._get_or_create_materias(cursor, [nombre]).get(nombre)
+
+    def _get_or_create_materias(self, cursor: sqlite3.Cursor, nombres: List[str]) -> Dict[str, int]:
+        cache = self._cache_materias(cursor)
+        faltantes = [n for n in dict.fromkeys(nombres) if n not in cache]
+        if faltantes:
+            cursor.executemany("INSERT OR IGNORE INTO materia (nombre) VALUES (?)",
+                               [(n,) for n in faltantes])
+            placeholders = ','.join('?' * len(faltantes))
+            cursor.execute(f"SELECT nombre, id FROM materia WHERE nombre IN ({placeholders})", faltantes)
+            with materias_cache_lock:
+                cache.update({row[0]: row[1] for row in cursor.fetchall()})
+        return {n: cache[n] for n in nombres if n in cache}
 
     def _asignar_materias_a_tesis(self, ius: str, materias_str: str):
         if not materias_str:
             return
-        self.cursor.execute("DELETE FROM tesis_materia WHERE tesis_ius = ?", (ius,))
-        materias = [m.strip() for m in materias_str.split(',') if m.strip()]
-        contador = 0
-        for materia in materias:
-            materia_id = self._get_or_create_materia(materia)
-            if materia_id:
-                self.cursor.execute('''
-                    INSERT OR IGNORE INTO tesis_materia (tesis_ius, materia_id)
-                    VALUES (?, ?)
-                ''', (ius, materia_id))
-                contador += 1
-        self.conn.commit()
+        try:
+            self._escribir(lambda cursor: self._asignar_materias_lote(cursor, [(ius, materias_str)]))
+        except Exception:
+            self._invalidar_cache_materias()
+            raise
+
+    def _asignar_materias_lote(self, cursor: sqlite3.Cursor, asignaciones: List[Tuple[str, str]]):
+        materias_por_tesis = {}
+        for ius, materias_str in asignaciones:
+            if not materias_str:
+                continue
+            materias = [m.strip() for m in materias_str.split(',') if m.strip()]
+            materias_por_tesis[str(ius)] = list(dict.fromkeys(materias))
+        if not materias_por_tesis:
+            return
+        ids = self._get_or_create_materias(cursor, [m for materias in materias_por_tesis.values() for m in materias])
+        cursor.executemany("DELETE FROM tesis_materia WHERE tesis_ius = ?",
+                           [(ius,) for ius in materias_por_tesis])
+        cursor.executemany('''
+            INSERT OR IGNORE INTO tesis_materia (tesis_ius, materia_id)
+            VALUES (?, ?)
+        ''', [(ius, ids[m]) for ius, materias in materias_por_tesis.items() for m in materias if m in ids])
+        cursor.executemany("UPDATE tesis SET materias_texto = ? WHERE ius = ?", [
+            (', '.join(m for m in materias if m in ids), ius) for ius, materias in materias_por_tesis.items()
+        ])
 
     def tesis_exists(self, ius: str) -> bool:
-        self.cursor.execute("SELECT 1 FROM tesis WHERE ius = ?", (ius,))
-        return self.cursor.fetchone() is not None
+        with self._lectura() as cursor:
+            cursor.execute("SELECT 1 FROM tesis WHERE ius = ?", (ius,))
+            return cursor.fetchone() is not None
 
     def insert_tesis(self, tesis_data: Dict) -> bool:
+        nuevas, _ = self.insert_tesis_lote([tesis_data])
+        return nuevas == 1
+
+    def insert_tesis_lote(self, tesis_lista: List[Dict]) -> Tuple[int, int]:
+        tesis_lista = [t for t in tesis_lista if t.get('IUS')]
+        if not tesis_lista:
+            return 0, 0
+        ius_lote = list(dict.fromkeys(str(t['IUS']) for t in tesis_lista))
+        fecha_actual = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
         try:
-            if self.tesis_exists(tesis_data['IUS']):
-                self.cursor.execute('''
-                    UPDATE tesis SET
-                        rubro = ?,
-                        clave_tesis = ?,
-                        localizacion = ?,
-                        sala = ?,
-                        epoca = ?,
-                        instancia = ?,
-                        fuente = ?,
-                        tipo_tesis = ?,
-                        tipo_jurisprudencia = ?,
-                        tipo_jurisprudencia_texto = ?,
-                        epoca_config = ?,
-                        tipo_tesis_config = ?,
-                        tomo = ?,
-                        pagina = ?,
-                        mes = ?,
-                        anio = ?,
-                        fecha_actualizacion = ?,
-                        descargado = COALESCE(descargado, 'No'),
-                        ubicacion = COALESCE(ubicacion, '')
-                    WHERE ius = ?
-                ''', (
-                    tesis_data['Rubro'],
-                    tesis_data['Clave_Tesis'],
-                    tesis_data['Localizacion'],
-                    tesis_data['Sala'],
-                    tesis_data['Epoca'],
-                    tesis_data['Instancia'],
-                    tesis_data['Fuente'],
-                    tesis_data['Tipo_Tesis'],
-                    tesis_data['Tipo_Jurisprudencia'],
-                    tesis_data['Tipo_Jurisprudencia_Texto'],
-                    tesis_data['Epoca_Config'],
-                    tesis_data['Tipo_Tesis_Config'],
-                    tesis_data.get('Tomo', ''),
-                    tesis_data.get('Pagina', ''),
-                    tesis_data.get('Mes', ''),
-                    tesis_data.get('Anio', ''),
-                    datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
-                    tesis_data['IUS']
-                ))
-                return False
-            else:
-                self.cursor.execute('''
-                    INSERT INTO tesis (
-                        ius, id, rubro, clave_tesis, localizacion, sala, epoca,
-                        instancia, fuente, tipo_tesis, tipo_jurisprudencia,
-                        tipo_jurisprudencia_texto,
-                        epoca_config, tipo_tesis_config,
-                        tomo, pagina, mes, anio, fecha_extraccion, fecha_actualizacion,
-                        descargado, ubicacion
-                    ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, 'No', '')
-                ''', (
-                    tesis_data['IUS'],
-                    tesis_data['ID'],
-                    tesis_data['Rubro'],
-                    tesis_data['Clave_Tesis'],
-                    tesis_data['Localizacion'],
-                    tesis_data['Sala'],
-                    tesis_data['Epoca'],
-                    tesis_data['Instancia'],
-                    tesis_data['Fuente'],
-                    tesis_data['Tipo_Tesis'],
-                    tesis_data['Tipo_Jurisprudencia'],
-                    tesis_data['Tipo_Jurisprudencia_Texto'],
-                    tesis_data['Epoca_Config'],
-                    tesis_data['Tipo_Tesis_Config'],
-                    tesis_data.get('Tomo', ''),
-                    tesis_data.get('Pagina', ''),
-                    tesis_data.get('Mes', ''),
-                    tesis_data.get('Anio', ''),
-                    tesis_data['Fecha_Extraccion'],
-                    datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-                ))
-                return True
-        except sqlite3.IntegrityError as e:
-            logging.error(f"Error de integridad al insertar tesis {tesis_data['IUS']}: {e}")
-            return False
+            existentes = self._escribir(lambda cursor: self._insertar_tesis(cursor, tesis_lista, fecha_actual))
+        except sqlite3.Error as e:
+            logging.error(f"Error al insertar lote de {len(tesis_lista)} tesis: {e}")
+            return 0, 0
+        nuevas = len(set(ius_lote) - existentes)
+        return nuevas, len(ius_lote) - nuevas
+
+    def _insertar_tesis(self, cursor: sqlite3.Cursor, tesis_lista: List[Dict], fecha_actual: str,
+                        forzar: bool = False) -> set:
+        # Devuelve los IUS que ya existían; con `forzar` se reescriben aunque el hash no cambie
+        tesis_lista = [t for t in tesis_lista if t.get('IUS')]
+        if not tesis_lista:
+            return set()
+        ius_lote = list(dict.fromkeys(str(t['IUS']) for t in tesis_lista))
+        placeholders = ','.join('?' * len(ius_lote))
+        cursor.execute(f"SELECT ius FROM tesis WHERE ius IN ({placeholders})", ius_lote)
+        existentes = {row[0] for row in cursor.fetchall()}
+        cursor.executemany(f'''
+            INSERT INTO tesis (
+                ius, id, rubro, clave_tesis, localizacion, sala, epoca,
+                instancia, fuente, tipo_tesis, tipo_jurisprudencia,
+                tipo_jurisprudencia_texto,
+                epoca_config, tipo_tesis_config,
+                tomo, pagina, mes, anio, fecha_extraccion, fecha_actualizacion,
+                descargado, ubicacion, hash_contenido
+            ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, 'No', '', ?)
+            ON CONFLICT(ius) DO UPDATE SET
+                rubro = excluded.rubro,
+                clave_tesis = excluded.clave_tesis,
+                localizacion = excluded.localizacion,
+                sala = excluded.sala,
+                epoca = excluded.epoca,
+                instancia = excluded.instancia,
+                fuente = excluded.fuente,
+                tipo_tesis = excluded.tipo_tesis,
+                tipo_jurisprudencia = excluded.tipo_jurisprudencia,
+                tipo_jurisprudencia_texto = excluded.tipo_jurisprudencia_texto,
+                epoca_config = excluded.epoca_config,
+                tipo_tesis_config = excluded.tipo_tesis_config,
+                tomo = excluded.tomo,
+                pagina = excluded.pagina,
+                mes = excluded.mes,
+                anio = excluded.anio,
+                fecha_actualizacion = excluded.fecha_actualizacion,
+                descargado = COALESCE(tesis.descargado, 'No'),
+                ubicacion = COALESCE(tesis.ubicacion, ''),
+                hash_contenido = excluded.hash_contenido
+            {'' if forzar else 'WHERE tesis.hash_contenido IS NOT excluded.hash_contenido'}
+        ''', [(
+            str(tesis_data['IUS']),
+            tesis_data['ID'],
+            tesis_data['Rubro'],
+            tesis_data['Clave_Tesis'],
+            tesis_data['Localizacion'],
+            tesis_data['Sala'],
+            tesis_data['Epoca'],
+            tesis_data['Instancia'],
+            tesis_data['Fuente'],
+            tesis_data['Tipo_Tesis'],
+            tesis_data['Tipo_Jurisprudencia'],
+            tesis_data['Tipo_Jurisprudencia_Texto'],
+            tesis_data['Epoca_Config'],
+            tesis_data['Tipo_Tesis_Config'],
+            tesis_data.get('Tomo', ''),
+            tesis_data.get('Pagina', ''),
+            tesis_data.get('Mes', ''),
+            tesis_data.get('Anio', ''),
+            tesis_data.get('Fecha_Extraccion', fecha_actual),
+            fecha_actual,
+            self._hash_contenido(tesis_data)
+        ) for tesis_data in tesis_lista])
+        return existentes
+
+    def _hash_contenido(self, tesis_data: Dict) -> str:
+        if tesis_data.get('Hash_Contenido'):
+            return tesis_data['Hash_Contenido']
+        return hash_payload({k: v for k, v in tesis_data.items() if k != 'Fecha_Extraccion'})
+
+    def _hash_detalle(self, tesis_data: Dict) -> str:
+        if tesis_data.get('Hash_Detalle'):
+            return tesis_data['Hash_Detalle']
+        return hash_payload({k: tesis_data.get(k) for k in ('Precedentes', 'Materias', 'Ejecutorias', 'Votos', 'Volumen')})
+
+    def tesis_sin_cambios(self, tesis_lista: List[Dict]) -> set:
+        ius_lote = list(dict.fromkeys(str(t['IUS']) for t in tesis_lista if t.get('IUS')))
+        if not ius_lote:
+            return set()
+        placeholders = ','.join('?' * len(ius_lote))
+        with self._lectura() as cursor:
+            cursor.execute(f'''
+                SELECT ius, hash_contenido FROM tesis
+                WHERE ius IN ({placeholders}) AND hash_detalle IS NOT NULL
+            ''', ius_lote)
+            guardadas = {row[0]: row[1] for row in cursor.fetchall()}
+        return {str(t['IUS']) for t in tesis_lista
+                if t.get('IUS') and guardadas.get(str(t['IUS'])) == self._hash_contenido(t)}
 
     def actualizar_tesis_detalles(self, tesis_data: Dict) -> bool:
+        actualizadas, _ = self.actualizar_tesis_detalles_lote([tesis_data])
+        return actualizadas == 1
+
+    def actualizar_tesis_detalles_lote(self, detalles_lista: List[Dict]) -> Tuple[int, int]:
+        if not detalles_lista:
+            return 0, 0
+        fecha_actual = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
         try:
-            self.cursor.execute('''
-                UPDATE tesis SET
-                    precedentes = COALESCE(?, precedentes),
-                    ejecutorias = COALESCE(?, ejecutorias),
-                    votos = COALESCE(?, votos),
-                    volumen = COALESCE(?, volumen),
-                    fecha_actualizacion = ?
-                WHERE ius = ?
-            ''', (
-                tesis_data.get('Precedentes'),
-                tesis_data.get('Ejecutorias'),
-                tesis_data.get('Votos'),
-                tesis_data.get('Volumen'),
-                datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
-                tesis_data['IUS']
-            ))
-            if 'Materias' in tesis_data and tesis_data['Materias']:
-                self._asignar_materias_a_tesis(tesis_data['IUS'], tesis_data['Materias'])
-            self.conn.commit()
-            return True
+            return len(self._escribir(lambda cursor: self._actualizar_detalles(cursor, detalles_lista, fecha_actual))), 0
         except Exception as e:
-            logging.error(f"Error al actualizar detalles de tesis {tesis_data.get('IUS', 'DESCONOCIDO')}: {e}")
-            return False
+            self._invalidar_cache_materias()
+            logging.error(f"Error al actualizar detalles de {len(detalles_lista)} tesis: {e}")
+            return 0, len(detalles_lista)
+
+    def _actualizar_detalles(self, cursor: sqlite3.Cursor, detalles_lista: List[Dict], fecha_actual: str,
+                             forzar: bool = False) -> set:
+        if not detalles_lista:
+            return set()
+        hashes = {str(t['IUS']): self._hash_detalle(t) for t in detalles_lista}
+        placeholders = ','.join('?' * len(hashes))
+        cursor.execute(f"SELECT ius, hash_detalle FROM tesis WHERE ius IN ({placeholders})", list(hashes))
+        guardados = {row[0]: row[1] for row in cursor.fetchall()}
+        cambiadas = [t for t in detalles_lista
+                     if str(t['IUS']) in guardados and (forzar or guardados[str(t['IUS'])] != hashes[str(t['IUS'])])]
+        cursor.executemany('''
+            UPDATE tesis SET
+                precedentes = COALESCE(?, precedentes),
+                ejecutorias = COALESCE(?, ejecutorias),
+                votos = COALESCE(?, votos),
+                volumen = COALESCE(?, volumen),
+                hash_detalle = ?,
+                fecha_actualizacion = ?
+            WHERE ius = ?
+        ''', [(
+            tesis_data.get('Precedentes'),
+            tesis_data.get('Ejecutorias'),
+            tesis_data.get('Votos'),
+            tesis_data.get('Volumen'),
+            hashes[str(tesis_data['IUS'])],
+            fecha_actual,
+            str(tesis_data['IUS'])
+        ) for tesis_data in cambiadas])
+        self._asignar_materias_lote(cursor, [(t['IUS'], t.get('Materias')) for t in cambiadas])
+        return {str(t['IUS']) for t in cambiadas}
+
+    def guardar_lote_extraccion(self, tesis_lista: List[Dict], detalles_lista: List[Dict],
+                                paginas: List[Tuple[str, str, int, int, str]],
+                                forzar: bool = False) -> Optional[Tuple[set, set]]:
+        # Devuelve (IUS que ya existían, IUS con detalle reescrito), o None si la escritura falló
+        fecha_actual = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+
+        def operacion(cursor):
+            existentes = self._insertar_tesis(cursor, tesis_lista, fecha_actual, forzar)
+            actualizadas = self._actualizar_detalles(cursor, detalles_lista, fecha_actual, forzar)
+            for epoca, tipo_tesis, pagina, total_tesis, estado in paginas:
+                self._registrar_extraccion(cursor, epoca, tipo_tesis, pagina, total_tesis, estado)
+            return existentes, actualizadas
+
+        try:
+            return self._escribir(operacion)
+        except Exception as e:
+            self._invalidar_cache_materias()
+            logging.error(f"Error al guardar lote de extracción ({len(tesis_lista)} tesis, {len(paginas)} páginas): {e}")
+            return None
 
     def _build_fts_query(self, texto: str) -> str:
         if not texto or not texto.strip():
@@ -462,19 +998,16 @@ class SCJNTesisDatabase:
         if condiciones:
             query += " WHERE " + " AND ".join(condiciones)
 
-        self.cursor.execute(query, params)
-        return self.cursor.fetchone()[0]
+        with self._lectura() as cursor:
+            cursor.execute(query, params)
+            return cursor.fetchone()[0]
 
     def obtener_tesis_paginadas_keyset(self, materia: str = None, epoca: str = None,
                                        texto: str = "", limite: int = 50,
-                                       ultimo_ius: str = None, ultima_fecha: str = None) -> List[Dict]:
+                                       ultimo_ius: str = None, ultima_fecha: str = None) -> Tuple[List[Dict], bool]:
         query = '''
             SELECT t.ius, t.epoca_config, t.rubro, t.clave_tesis, t.descargado,
-                   t.fecha_actualizacion,
-                   (SELECT GROUP_CONCAT(m.nombre, ', ') 
-                    FROM tesis_materia tm 
-                    JOIN materia m ON tm.materia_id = m.id 
-                    WHERE tm.tesis_ius = t.ius) as materias
+                   t.fecha_actualizacion, t.materias_texto as materias
             FROM tesis t
         '''
         params = []
@@ -505,65 +1038,135 @@ class SCJNTesisDatabase:
             query += " WHERE " + " AND ".join(condiciones)
 
         query += " ORDER BY t.fecha_actualizacion DESC, t.ius DESC LIMIT ?"
-        params.append(limite)
+        params.append(limite + 1)
 
-        self.cursor.execute(query, params)
-        return [dict(row) for row in self.cursor.fetchall()]
+        with self._lectura() as cursor:
+            cursor.execute(query, params)
+            filas = [dict(row) for row in cursor.fetchall()]
+        return filas[:limite], len(filas) > limite
 
     def obtener_tesis_por_ius(self, ius: str) -> Dict:
         query = '''
             SELECT t.ius, t.epoca_config, t.rubro, t.clave_tesis, t.descargado, t.ubicacion,
-                   (SELECT GROUP_CONCAT(m.nombre, ', ') 
-                    FROM tesis_materia tm 
-                    JOIN materia m ON tm.materia_id = m.id 
-                    WHERE tm.tesis_ius = t.ius) as materias
+                   t.materias_texto as materias
             FROM tesis t
             WHERE t.ius = ?
         '''
-        self.cursor.execute(query, (ius,))
-        row = self.cursor.fetchone()
+        with self._lectura() as cursor:
+            cursor.execute(query, (ius,))
+            row = cursor.fetchone()
         return dict(row) if row else {}
 
     def obtener_tesis_por_descargar(self, limite: int = None, incluir_fallidas: bool = False) -> List[Dict]:
+        return list(itertools.islice(self.iterar_tesis_por_descargar(incluir_fallidas), limite))
+
+    def iterar_tesis_por_descargar(self, incluir_fallidas: bool = False,
+                                   lote: int = LOTE_PENDIENTES_DESCARGA) -> Iterator[Dict]:
+        ahora = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+        inicio = datetime.now().strftime('%Y-%m-%d %H:%M:%S.%f')
+        # Sin estadísticas el planificador prefiere idx_tesis_descargado y ordena aparte; se fuerza el parcial
+        pendientes = "tesis INDEXED BY idx_tesis_pendientes_descarga WHERE descargado = 'No'"
+        pasadas = [(pendientes, "COALESCE(intentos_descarga, 0) = 0", ())]
+        # Las que fallan en la primera pasada no se repiten en esta misma ejecución
+        fallidas = "COALESCE(intentos_descarga, 0) > 0 AND (fecha_ultimo_fallo IS NULL OR fecha_ultimo_fallo < ?)"
         if incluir_fallidas:
-            query = '''
-                SELECT ius, epoca_config, rubro, clave_tesis, epoca 
-                FROM tesis 
-                WHERE descargado = 'No' OR descargado IS NULL
-                ORDER BY ius
-            '''
+            pasadas.append((pendientes, fallidas, (inicio,)))
+            pasadas.append(("tesis WHERE descargado IS NULL", "1", ()))
         else:
-            query = '''
-                SELECT ius, epoca_config, rubro, clave_tesis, epoca 
-                FROM tesis 
-                WHERE descargado = 'No' 
-                ORDER BY ius
-            '''
-        if limite:
-            query += " LIMIT ?"
-            self.cursor.execute(query, (limite,))
-        else:
-            self.cursor.execute(query)
-        return [dict(t) for t in self.cursor.fetchall()]
+            pasadas.append((pendientes, f"{fallidas} AND COALESCE(aparcada, 0) = 0 "
+                                        "AND (proximo_reintento IS NULL OR proximo_reintento <= ?)", (inicio, ahora)))
+        for origen, condicion, parametros in pasadas:
+            ultimo = ''
+            while True:
+                with self._lectura() as cursor:
+                    cursor.execute(f'''
+                        SELECT ius, epoca_config, rubro, clave_tesis, epoca
+                        FROM {origen} AND ius > ? AND {condicion}
+                        ORDER BY ius
+                        LIMIT ?
+                    ''', (ultimo,) + parametros + (lote,))
+                    filas = [dict(t) for t in cursor.fetchall()]
+                yield from filas
+                if len(filas) < lote:
+                    break
+                ultimo = filas[-1]['ius']
+
+    def contar_tesis_por_descargar(self, incluir_fallidas: bool = False) -> int:
+        condicion = "(descargado = 'No' OR descargado IS NULL)" if incluir_fallidas else \
+            "descargado = 'No' AND COALESCE(aparcada, 0) = 0 AND (proximo_reintento IS NULL OR proximo_reintento <= ?)"
+        with self._lectura() as cursor:
+            cursor.execute(f"SELECT COUNT(*) FROM tesis WHERE {condicion}",
+                           () if incluir_fallidas else (datetime.now().strftime('%Y-%m-%d %H:%M:%S'),))
+            return cursor.fetchone()[0]
+
+    def registrar_fallo_descarga(self, ius: str, status_http: Optional[int], error: str) -> bool:
+        def operacion(cursor):
+            cursor.execute('SELECT COALESCE(intentos_descarga, 0) FROM tesis WHERE ius = ?', (ius,))
+            fila = cursor.fetchone()
+            intentos = (fila[0] if fila else 0) + 1
+            espera = min(BACKOFF_DESCARGA_MAXIMO, BACKOFF_DESCARGA_BASE * 2 ** (intentos - 1))
+            ahora = datetime.now()
+            cursor.execute('''
+                UPDATE tesis
+                SET intentos_descarga = ?, ultimo_error = ?, ultimo_status_http = ?,
+                    proximo_reintento = ?, aparcada = ?, fecha_ultimo_fallo = ?
+                WHERE ius = ?
+            ''', (intentos, error, status_http,
+                  (ahora + timedelta(seconds=espera)).strftime('%Y-%m-%d %H:%M:%S'),
+                  int(status_http in STATUS_DESCARGA_PERMANENTES), ahora.strftime('%Y-%m-%d %H:%M:%S.%f'), ius))
+        try:
+            self._escribir(operacion)
+            return True
+        except Exception as e:
+            logging.error(f"Error al registrar fallo de descarga de {ius}: {e}")
+            return False
 
     def marcar_como_descargado(self, ius: str, ubicacion: str) -> bool:
         try:
-            self.cursor.execute('''
-                UPDATE tesis 
-                SET descargado = 'Sí', ubicacion = ?, fecha_actualizacion = ?
+            self._escribir(lambda cursor: cursor.execute('''
+                UPDATE tesis
+                SET descargado = 'Sí', ubicacion = ?, fecha_actualizacion = ?,
+                    intentos_descarga = 0, ultimo_error = NULL, ultimo_status_http = NULL,
+                    proximo_reintento = NULL, aparcada = 0
                 WHERE ius = ?
-            ''', (ubicacion, datetime.now().strftime('%Y-%m-%d %H:%M:%S'), ius))
-            self.conn.commit()
+            ''', (ubicacion, datetime.now().strftime('%Y-%m-%d %H:%M:%S'), ius)))
             return True
         except Exception as e:
             logging.error(f"Error al marcar tesis {ius} como descargada: {e}")
             return False
 
+    def estado_descargas(self) -> List[Tuple[str, bool, str, str]]:
+        with self._lectura() as cursor:
+            cursor.execute("SELECT ius, descargado = 'Sí', ubicacion, epoca_config FROM tesis")
+            return [(fila[0], bool(fila[1]), fila[2] or '', fila[3] or '') for fila in cursor.fetchall()]
+
+    def reconciliar_descargas(self, encontradas: List[Tuple[str, str]], perdidas: List[str]) -> bool:
+        # `encontradas` son (ius, ubicacion) a marcar; `perdidas`, IUS cuyo PDF ya no está en disco
+        fecha = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+        def operacion(cursor):
+            cursor.executemany('''
+                UPDATE tesis
+                SET descargado = 'Sí', ubicacion = ?, fecha_actualizacion = ?,
+                    intentos_descarga = 0, ultimo_error = NULL, ultimo_status_http = NULL,
+                    proximo_reintento = NULL, aparcada = 0
+                WHERE ius = ?
+            ''', [(ubicacion, fecha, ius) for ius, ubicacion in encontradas])
+            cursor.executemany('''
+                UPDATE tesis SET descargado = 'No', ubicacion = NULL, fecha_actualizacion = ? WHERE ius = ?
+            ''', [(fecha, ius) for ius in perdidas])
+        try:
+            self._escribir(operacion)
+            return True
+        except Exception as e:
+            logging.error(f"Error al reconciliar descargas: {e}")
+            return False
+
     def verificar_estado_descarga(self, ius: str) -> Tuple[bool, str]:
-        self.cursor.execute('''
-            SELECT descargado, ubicacion FROM tesis WHERE ius = ?
-        ''', (ius,))
-        row = self.cursor.fetchone()
+        with self._lectura() as cursor:
+            cursor.execute('''
+                SELECT descargado, ubicacion FROM tesis WHERE ius = ?
+            ''', (ius,))
+            row = cursor.fetchone()
         if row:
             return row[0] == 'Sí', row[1] or ''
         return False, ''
@@ -572,15 +1175,9 @@ class SCJNTesisDatabase:
         if not output_file:
             timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
             output_file = f"tesis_export_{timestamp}.csv"
-        query = '''
-            SELECT t.*, 
-                   (SELECT GROUP_CONCAT(m.nombre, ', ') 
-                    FROM tesis_materia tm 
-                    JOIN materia m ON tm.materia_id = m.id 
-                    WHERE tm.tesis_ius = t.ius) as materias
-            FROM tesis t
-        '''
-        df = pd.read_sql_query(query, self.conn)
+        with self.capa.lectores.conexion() as conn:
+            df = pd.read_sql_query(
+                f"SELECT {', '.join(COLUMNAS_EXPORTACION_TESIS)}, materias_texto AS materias FROM tesis", conn)
         df.to_csv(output_file, index=False, encoding='utf-8-sig')
         return output_file
 
@@ -588,164 +1185,832 @@ class SCJNTesisDatabase:
         if not output_file:
             timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
             output_file = f"resumenes_tesis_{timestamp}.xlsx"
-        with pd.ExcelWriter(output_file, engine='openpyxl') as writer:
+        with pd.ExcelWriter(output_file, engine='openpyxl') as writer, self.capa.lectores.conexion() as conn:
             tablas = ['resumen_epoca', 'resumen_tipo_tesis', 'resumen_sala',
                      'resumen_tipo_jurisprudencia', 'resumen_materia']
             for tabla in tablas:
-                df = pd.read_sql_query(f"SELECT * FROM {tabla}", self.conn)
+                df = pd.read_sql_query(f"SELECT * FROM {tabla}", conn)
                 df.to_excel(writer, sheet_name=tabla, index=False)
         return output_file
 
     def registrar_extraccion(self, epoca: str, tipo_tesis: str, pagina: int,
                              total_tesis: int = 0, estado: str = 'completada'):
-        hash_config = hashlib.md5(f"{epoca}_{tipo_tesis}_{pagina}".encode()).hexdigest()
         try:
-            self.cursor.execute('''
-                INSERT OR REPLACE INTO control_extracciones 
-                (epoca, tipo_tesis, pagina, total_tesis, fecha_inicio, fecha_fin, estado, hash_config)
-                VALUES (?, ?, ?, ?, ?, ?, ?, ?)
-            ''', (
-                epoca, tipo_tesis, pagina, total_tesis,
-                datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
-                datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
-                estado, hash_config
-            ))
-            self.conn.commit()
+            self._escribir(lambda cursor: self._registrar_extraccion(cursor, epoca, tipo_tesis, pagina,
+                                                                     total_tesis, estado))
         except Exception as e:
             logging.error(f"Error al registrar extracción: {e}")
 
+    def _registrar_extraccion(self, cursor: sqlite3.Cursor, epoca: str, tipo_tesis: str, pagina: int,
+                              total_tesis: int, estado: str):
+        hash_config = hashlib.md5(f"{epoca}_{tipo_tesis}_{pagina}".encode()).hexdigest()
+        cursor.execute('''
+            INSERT INTO control_extracciones
+            (epoca, tipo_tesis, pagina, total_tesis, fecha_inicio, fecha_fin, estado, hash_config)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+            ON CONFLICT(epoca, tipo_tesis, pagina) DO UPDATE SET
+                total_tesis = excluded.total_tesis,
+                fecha_inicio = excluded.fecha_inicio,
+                fecha_fin = excluded.fecha_fin,
+                estado = excluded.estado,
+                hash_config = excluded.hash_config
+        ''', (
+            epoca, tipo_tesis, pagina, total_tesis,
+            datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+            datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+            estado, hash_config
+        ))
+
     def pagina_procesada(self, epoca: str, tipo_tesis: str, pagina: int) -> bool:
-        self.cursor.execute('''
-            SELECT 1 FROM control_extracciones 
-            WHERE epoca = ? AND tipo_tesis = ? AND pagina = ? AND estado = 'completada'
-        ''', (epoca, tipo_tesis, pagina))
-        return self.cursor.fetchone() is not None
+        with self._lectura() as cursor:
+            cursor.execute('''
+                SELECT 1 FROM control_extracciones
+                WHERE epoca = ? AND tipo_tesis = ? AND pagina = ? AND estado = 'completada'
+            ''', (epoca, tipo_tesis, pagina))
+            return cursor.fetchone() is not None
+
+    def cargar_variantes_detalle(self) -> Dict[str, Dict]:
+        with self._lectura() as cursor:
+            cursor.execute('''
+                SELECT clave, exitos_normal, exitos_semanal, consultas, aciertos FROM variantes_detalle
+            ''')
+            return {fila[0]: {'exitos_normal': fila[1], 'exitos_semanal': fila[2],
+                              'consultas': fila[3], 'aciertos': fila[4]}
+                    for fila in cursor.fetchall()}
 
-    def limpiar_control_extracciones(self, epoca: str = None, tipo_tesis: str = None):
+    def guardar_variantes_detalle(self, variantes: Dict[str, Dict]):
+        fecha = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
         try:
+            self._escribir(lambda cursor: cursor.executemany('''
+                INSERT INTO variantes_detalle
+                (clave, exitos_normal, exitos_semanal, consultas, aciertos, fecha_actualizacion)
+                VALUES (?, ?, ?, ?, ?, ?)
+                ON CONFLICT(clave) DO UPDATE SET
+                    exitos_normal = excluded.exitos_normal,
+                    exitos_semanal = excluded.exitos_semanal,
+                    consultas = excluded.consultas,
+                    aciertos = excluded.aciertos,
+                    fecha_actualizacion = excluded.fecha_actualizacion
+            ''', [(clave, v['exitos_normal'], v['exitos_semanal'], v['consultas'], v['aciertos'], fecha)
+                  for clave, v in variantes.items()]))
+        except Exception as e:
+            logging.error(f"Error al guardar variantes de detalle: {e}")
+
+    def paginas_completadas(self, epoca: str, tipo_tesis: str) -> set:
+        with self._lectura() as cursor:
+            cursor.execute('''
+                SELECT pagina FROM control_extracciones
+                WHERE epoca = ? AND tipo_tesis = ? AND estado = 'completada'
+            ''', (epoca, tipo_tesis))
+            return {fila[0] for fila in cursor.fetchall()}
+
+    def limpiar_control_extracciones(self, epoca: str = None, tipo_tesis: str = None):
+        def operacion(cursor):
             if epoca and tipo_tesis:
-                self.cursor.execute('DELETE FROM control_extracciones WHERE epoca = ? AND tipo_tesis = ?',
-                                    (epoca, tipo_tesis))
+                cursor.execute('DELETE FROM control_extracciones WHERE epoca = ? AND tipo_tesis = ?',
+                               (epoca, tipo_tesis))
             elif epoca:
-                self.cursor.execute('DELETE FROM control_extracciones WHERE epoca = ?', (epoca,))
+                cursor.execute('DELETE FROM control_extracciones WHERE epoca = ?', (epoca,))
             else:
-                self.cursor.execute('DELETE FROM control_extracciones')
-            self.conn.commit()
+                cursor.execute('DELETE FROM control_extracciones')
+
+        try:
+            self._escribir(operacion)
             return True
         except Exception as e:
             logging.error(f"Error al limpiar control de extracciones: {e}")
             return False
 
-    def actualizar_resumenes(self):
-        temp_conn = None
+    def reconstruir_resumenes(self):
         try:
-            temp_conn = sqlite3.connect(self.db_path, timeout=10)
-            temp_conn.row_factory = sqlite3.Row
-            temp_conn.execute("PRAGMA journal_mode=WAL")
-            temp_conn.execute("PRAGMA cache_size = 0")
-            temp_conn.execute("BEGIN IMMEDIATE")
-            temp_cursor = temp_conn.cursor()
-            fecha_actual = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-            temp_cursor.execute("DELETE FROM resumen_epoca")
-            temp_cursor.execute('''
-                INSERT INTO resumen_epoca (epoca, cantidad, fecha_actualizacion)
-                SELECT epoca_config, COUNT(*), ? FROM tesis GROUP BY epoca_config
-            ''', (fecha_actual,))
-            temp_cursor.execute("DELETE FROM resumen_tipo_tesis")
-            temp_cursor.execute('''
-                INSERT INTO resumen_tipo_tesis (tipo_tesis, cantidad, fecha_actualizacion)
-                SELECT tipo_tesis_config, COUNT(*), ? FROM tesis GROUP BY tipo_tesis_config
-            ''', (fecha_actual,))
-            temp_cursor.execute("DELETE FROM resumen_sala")
-            temp_cursor.execute('''
-                INSERT INTO resumen_sala (sala, cantidad, fecha_actualizacion)
-                SELECT sala, COUNT(*), ? FROM tesis WHERE sala IS NOT NULL AND sala != '' GROUP BY sala
-            ''', (fecha_actual,))
-            temp_cursor.execute("DELETE FROM resumen_tipo_jurisprudencia")
-            temp_cursor.execute('''
-                INSERT INTO resumen_tipo_jurisprudencia (tipo_jurisprudencia, cantidad, fecha_actualizacion)
-                SELECT tipo_jurisprudencia_texto, COUNT(*), ? FROM tesis WHERE tipo_jurisprudencia_texto IS NOT NULL GROUP BY tipo_jurisprudencia_texto
-            ''', (fecha_actual,))
-            temp_cursor.execute("DELETE FROM resumen_materia")
-            temp_cursor.execute('''
-                INSERT INTO resumen_materia (materia, cantidad, fecha_actualizacion)
-                SELECT m.nombre, COUNT(DISTINCT tm.tesis_ius), ?
-                FROM materia m
-                JOIN tesis_materia tm ON m.id = tm.materia_id
-                GROUP BY m.nombre
-            ''', (fecha_actual,))
-            temp_conn.commit()
+            self._escribir(self._reconstruir_resumenes)
         except Exception as e:
-            logging.error(f"Error en actualizar_resumenes: {e}")
-            if temp_conn:
-                temp_conn.rollback()
-        finally:
-            if temp_conn:
-                temp_conn.close()
+            logging.error(f"Error en reconstruir_resumenes: {e}")
+
+    def _reconstruir_resumenes(self, cursor: sqlite3.Cursor):
+        fecha_actual = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+        for tabla, clave, col in RESUMENES_TESIS:
+            cursor.execute(f"DELETE FROM {tabla}")
+            cursor.execute(f'''
+                INSERT INTO {tabla} ({clave}, cantidad, fecha_actualizacion)
+                SELECT {col}, COUNT(*), ? FROM tesis WHERE {col} IS NOT NULL AND {col} != '' GROUP BY {col}
+            ''', (fecha_actual,))
+        cursor.execute("DELETE FROM resumen_materia")
+        cursor.execute('''
+            INSERT INTO resumen_materia (materia, cantidad, fecha_actualizacion)
+            SELECT m.nombre, COUNT(DISTINCT tm.tesis_ius), ?
+            FROM materia m
+            JOIN tesis_materia tm ON m.id = tm.materia_id
+            GROUP BY m.nombre
+        ''', (fecha_actual,))
+        cursor.execute("SELECT COALESCE(MAX(valor), 0) FROM contadores WHERE clave = 'version'")
+        version = cursor.fetchone()[0] + 1
+        cursor.execute("DELETE FROM contadores")
+        cursor.execute('''
+            INSERT INTO contadores (clave, valor)
+            SELECT 'total_tesis', COUNT(*) FROM tesis
+            UNION ALL SELECT 'tesis_descargadas', COUNT(*) FROM tesis WHERE descargado = 'Sí'
+            UNION ALL SELECT 'paginas_procesadas', COUNT(*) FROM control_extracciones WHERE estado = 'completada'
+            UNION ALL SELECT 'version', ?
+        ''', (version,))
+
+    def fusionar_fts(self, paginas: int = 200) -> bool:
+        def operacion(cursor):
+            cambios_previos = cursor.connection.total_changes
+            cursor.execute("INSERT INTO tesis_fts(tesis_fts, rank) VALUES('merge', ?)", (paginas,))
+            return cursor.connection.total_changes - cambios_previos >= 2
+
+        return self._escribir(operacion)
+
+    def optimizar_fts(self):
+        self._escribir(lambda cursor: cursor.execute("INSERT INTO tesis_fts(tesis_fts) VALUES('optimize')"))
 
     def obtener_epocas_unicas(self) -> List[str]:
-        self.cursor.execute("""
-            SELECT DISTINCT epoca_config 
-            FROM tesis 
-            WHERE epoca_config IS NOT NULL AND epoca_config != ''
-            ORDER BY epoca_config
-        """)
-        epocas = [row[0] for row in self.cursor.fetchall()]
+        with self._lectura() as cursor:
+            cursor.execute("""
+                SELECT DISTINCT epoca_config
+                FROM tesis
+                WHERE epoca_config IS NOT NULL AND epoca_config != ''
+                ORDER BY epoca_config
+            """)
+            epocas = [row[0] for row in cursor.fetchall()]
         return ["Todas"] + epocas
 
     def obtener_materias_unicas(self) -> List[str]:
-        self.cursor.execute("""
-            SELECT nombre 
-            FROM materia 
-            ORDER BY nombre
-        """)
-        materias = [row[0] for row in self.cursor.fetchall()]
+        with self._lectura() as cursor:
+            cursor.execute("""
+                SELECT nombre
+                FROM materia
+                ORDER BY nombre
+            """)
+            materias = [row[0] for row in cursor.fetchall()]
         return ["Todas"] + materias
 
+    def _leer_contadores(self) -> Optional[Dict[str, int]]:
+        with self._lectura() as cursor:
+            cursor.execute("SELECT clave, valor FROM contadores")
+            contadores = {row[0]: row[1] for row in cursor.fetchall()}
+        claves = ('total_tesis', 'tesis_descargadas', 'paginas_procesadas', 'version')
+        if not all(contadores.get(clave) is not None for clave in claves):
+            return None
+        return contadores
+
+    def _contadores_vigentes(self) -> Dict[str, int]:
+        contadores = self._leer_contadores()
+        if contadores is None:
+            logging.info("Contadores de estadísticas desactualizados, reconstruyendo...")
+            self.reconstruir_resumenes()
+            contadores = self._leer_contadores() or {}
+        return contadores
+
+    def version_datos(self) -> int:
+        # Sello que los triggers suben con cada cambio que altera conteos o filtros
+        with self._lectura() as cursor:
+            cursor.execute("SELECT valor FROM contadores WHERE clave = 'version'")
+            fila = cursor.fetchone()
+        return fila[0] if fila else 0
+
+    def contar_tesis_combinacion(self, epoca_config: str, tipo_tesis_config: str) -> int:
+        with self._lectura() as cursor:
+            cursor.execute("SELECT COUNT(*) FROM tesis WHERE epoca_config = ? AND tipo_tesis_config = ?",
+                           (epoca_config, tipo_tesis_config))
+            return cursor.fetchone()[0]
+
+    def contar_tesis_pendientes(self) -> int:
+        contadores = self._contadores_vigentes()
+        return contadores.get('total_tesis', 0) - contadores.get('tesis_descargadas', 0)
+
     def obtener_estadisticas(self) -> Dict:
-        stats = {}
-        self.cursor.execute("SELECT COUNT(*) FROM tesis")
-        stats['total_tesis'] = self.cursor.fetchone()[0]
-        self.cursor.execute("SELECT COUNT(*) FROM tesis WHERE descargado = 'Sí'")
-        stats['tesis_descargadas'] = self.cursor.fetchone()[0]
-        self.cursor.execute("""
-            SELECT epoca_config, COUNT(*) 
-            FROM tesis 
-            WHERE epoca_config IS NOT NULL 
-            GROUP BY epoca_config 
-            ORDER BY epoca_config
-        """)
-        stats['por_epoca'] = dict(self.cursor.fetchall())
-        self.cursor.execute("""
-            SELECT tipo_tesis_config, COUNT(*) 
-            FROM tesis 
-            GROUP BY tipo_tesis_config
-        """)
-        stats['por_tipo_tesis'] = dict(self.cursor.fetchall())
-        self.cursor.execute("""
-            SELECT m.nombre, COUNT(DISTINCT tm.tesis_ius) as cantidad
-            FROM materia m
-            JOIN tesis_materia tm ON m.id = tm.materia_id
-            GROUP BY m.nombre
-            ORDER BY cantidad DESC
-            LIMIT 10
-        """)
-        stats['materias_comunes'] = dict(self.cursor.fetchall())
-        self.cursor.execute("SELECT MAX(fecha_actualizacion) FROM tesis")
-        stats['ultima_actualizacion'] = self.cursor.fetchone()[0]
-        self.cursor.execute("SELECT COUNT(*) FROM control_extracciones WHERE estado = 'completada'")
-        stats['paginas_procesadas'] = self.cursor.fetchone()[0]
+        contadores = self._contadores_vigentes()
+        stats = {
+            'total_tesis': contadores.get('total_tesis', 0),
+            'tesis_descargadas': contadores.get('tesis_descargadas', 0),
+            'paginas_procesadas': contadores.get('paginas_procesadas', 0),
+            'version': contadores.get('version', 0),
+        }
+        stats['tesis_pendientes'] = stats['total_tesis'] - stats['tesis_descargadas']
+        with self._lectura() as cursor:
+            cursor.execute("SELECT epoca, cantidad FROM resumen_epoca ORDER BY epoca")
+            stats['por_epoca'] = dict(cursor.fetchall())
+            cursor.execute("SELECT tipo_tesis, cantidad FROM resumen_tipo_tesis")
+            stats['por_tipo_tesis'] = dict(cursor.fetchall())
+            cursor.execute("SELECT materia, cantidad FROM resumen_materia ORDER BY cantidad DESC LIMIT 10")
+            stats['materias_comunes'] = dict(cursor.fetchall())
+            cursor.execute("SELECT MAX(fecha_actualizacion) FROM tesis")
+            stats['ultima_actualizacion'] = cursor.fetchone()[0]
         return stats
 
     def close(self):
-        if self.conn:
-            self.conn.close()
-            self.conn = None
-            self.cursor = None
+        self.capa = None
+
+
+def esperar_cancelable(segundos: float, cancelar: Callable = None):
+    limite = time.monotonic() + segundos
+    while True:
+        restante = limite - time.monotonic()
+        if restante <= 0 or (cancelar and cancelar()):
+            return
+        time.sleep(min(restante, 0.5))
+
+
+class CircuitoHost:
+    def __init__(self, host: str, umbral: int = 5, pausa: float = 30.0, pausa_maxima: float = 600.0):
+        self.host = host
+        self.umbral = umbral
+        self.pausa = pausa
+        self.pausa_maxima = pausa_maxima
+        self._fallos = 0
+        self._pausa_actual = pausa
+        self._abierto_hasta = 0.0
+        self._lock = threading.Lock()
+
+    @property
+    def abierto(self) -> bool:
+        with self._lock:
+            return time.monotonic() < self._abierto_hasta
+
+    def esperar(self, cancelar: Callable = None):
+        with self._lock:
+            espera = self._abierto_hasta - time.monotonic()
+        if espera > 0:
+            esperar_cancelable(espera, cancelar)
+
+    def registrar_exito(self):
+        with self._lock:
+            self._fallos = 0
+            self._pausa_actual = self.pausa
+
+    def registrar_fallo(self):
+        with self._lock:
+            ahora = time.monotonic()
+            self._fallos += 1
+            if self._fallos >= self.umbral and ahora >= self._abierto_hasta:
+                self._abierto_hasta = ahora + self._pausa_actual
+                logging.warning(f"{self.host} no responde ({self._fallos} fallos seguidos); "
+                                f"se pausa la extracción {self._pausa_actual:.0f} s")
+                self._pausa_actual = min(self.pausa_maxima, self._pausa_actual * 2)
+                self._fallos = self.umbral - 1
+
+
+class PeticionCancelada(Exception):
+    pass
+
+
+class ClienteHTTP:
+    def __init__(self, tamano_pool: int = None, timeout: float = 30):
+        self.timeout = timeout
+        self.tamano_pool = tamano_pool or tamano_pool_http()
+        self.session = requests.Session()
+        self.session.headers.update({
+            'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36',
+            'Accept-Encoding': 'gzip, deflate',
+            'Connection': 'keep-alive'
+        })
+        self._montar_adaptador()
+        self._lock = threading.Lock()
+        self._peticiones = 0
+        self._errores = 0
+        self._tiempo_total = 0.0
+        self._circuitos = {}
+
+    def _montar_adaptador(self):
+        self.adaptador = requests.adapters.HTTPAdapter(pool_connections=4, pool_maxsize=self.tamano_pool,
+                                                       pool_block=True)
+        self.session.mount('https://', self.adaptador)
+        self.session.mount('http://', self.adaptador)
+
+    def asegurar_pool(self, tamano_pool: int):
+        # Con pool_block=True un hilo sin conexión libre espera: el pool debe cubrir a todos los hilos
+        # El adaptador anterior no se cierra: sus peticiones en curso terminan con sus conexiones
+        with self._lock:
+            if tamano_pool > self.tamano_pool:
+                self.tamano_pool = tamano_pool
+                self._montar_adaptador()
+
+    def request(self, metodo: str, url: str, control: 'ControlAIMD' = None, **kwargs) -> requests.Response:
+        kwargs.setdefault('timeout', self.timeout)
+        if control and not control.adquirir():
+            raise PeticionCancelada(f"{metodo} {url} cancelada mientras esperaba turno")
+        inicio = time.perf_counter()
+        try:
+            response = self.session.request(metodo, url, **kwargs)
+        except requests.RequestException:
+            duracion = time.perf_counter() - inicio
+            with self._lock:
+                self._peticiones += 1
+                self._errores += 1
+                self._tiempo_total += duracion
+            if control:
+                control.registrar(None, duracion, error=True)
+            raise
+        duracion = time.perf_counter() - inicio
+        with self._lock:
+            self._peticiones += 1
+            self._tiempo_total += duracion
+        if control:
+            control.registrar(response.status_code, duracion, self._retry_after(response))
+        logging.debug(f"{metodo} {url} -> {response.status_code} en {duracion * 1000:.0f} ms")
+        return response
+
+    def get(self, url: str, **kwargs) -> requests.Response:
+        return self.request('GET', url, **kwargs)
+
+    def post(self, url: str, **kwargs) -> requests.Response:
+        return self.request('POST', url, **kwargs)
+
+    def circuito(self, url: str) -> CircuitoHost:
+        host = urlparse(url).netloc
+        with self._lock:
+            if host not in self._circuitos:
+                self._circuitos[host] = CircuitoHost(host)
+            return self._circuitos[host]
+
+    def request_con_reintentos(self, metodo: str, url: str, control: 'ControlAIMD' = None,
+                               reintentos: int = REINTENTOS_HTTP, cancelar: Callable = None,
+                               **kwargs) -> Optional[requests.Response]:
+        # Agotados los intentos devuelve la última respuesta, o None si nunca la hubo
+        circuito = self.circuito(url)
+        response = None
+        for intento in range(reintentos + 1):
+            if cancelar and cancelar():
+                break
+            circuito.esperar(cancelar)
+            if response is not None:
+                # Libera la conexión de la respuesta descartada (importa con stream=True)
+                response.close()
+            try:
+                response = self.request(metodo, url, control=control, **kwargs)
+            except PeticionCancelada:
+                return None
+            except requests.RequestException as e:
+                response = None
+                circuito.registrar_fallo()
+                logging.debug(f"{metodo} {url} falló (intento {intento + 1}): {e}")
+            else:
+                if response.status_code >= 500:
+                    circuito.registrar_fallo()
+                elif response.status_code != 429:
+                    circuito.registrar_exito()
+                    return response
+            if intento < reintentos:
+                esperar_cancelable(random.uniform(0, min(BACKOFF_MAXIMO, BACKOFF_BASE * 2 ** intento)), cancelar)
+        return response
+
+    @staticmethod
+    def _retry_after(response: requests.Response) -> Optional[float]:
+        valor = response.headers.get('Retry-After')
+        if not valor:
+            return None
+        try:
+            return max(0.0, float(valor))
+        except ValueError:
+            pass
+        try:
+            fecha = parsedate_to_datetime(valor)
+        except (TypeError, ValueError):
+            return None
+        return max(0.0, (fecha - datetime.now(fecha.tzinfo)).total_seconds())
+
+    def conexiones_abiertas(self) -> int:
+        pools = self.adaptador.poolmanager.pools
+        return sum(pools[clave].num_connections for clave in list(pools.keys()))
+
+    def estadisticas(self) -> Dict:
+        with self._lock:
+            peticiones, errores, tiempo_total = self._peticiones, self._errores, self._tiempo_total
+        conexiones = self.conexiones_abiertas()
+        return {
+            'peticiones': peticiones,
+            'errores': errores,
+            'latencia_media_ms': (tiempo_total / peticiones * 1000) if peticiones else 0.0,
+            'conexiones_abiertas': conexiones,
+            'peticiones_por_conexion': (peticiones / conexiones) if conexiones else 0.0
+        }
+
+    def cerrar(self):
+        self.session.close()
+
+
+def tamano_pool_http(workers_detalles: int = None, combinaciones_concurrentes: int = None,
+                     workers_descarga: int = None) -> int:
+    return ((workers_detalles or WORKERS_DETALLES)
+            + (combinaciones_concurrentes or COMBINACIONES_CONCURRENTES) * HILOS_PAGINAS_POR_COMBINACION
+            + (workers_descarga or WORKERS_DESCARGA))
+
+
+def obtener_cliente_http(tamano_pool: int = None) -> ClienteHTTP:
+    global CLIENTE_HTTP
+    with cliente_http_lock:
+        if CLIENTE_HTTP is None:
+            CLIENTE_HTTP = ClienteHTTP(tamano_pool)
+        elif tamano_pool:
+            CLIENTE_HTTP.asegurar_pool(tamano_pool)
+        return CLIENTE_HTTP
+
+
+class LimitadorTasa:
+    def __init__(self, tasa: float = PETICIONES_POR_SEGUNDO, capacidad: float = None, cancelar: Callable = None):
+        self.tasa = tasa
+        self.cancelar = cancelar
+        self.capacidad = capacidad if capacidad is not None else max(1.0, tasa)
+        self._tokens = self.capacidad
+        self._ultimo = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _reponer(self):
+        ahora = time.monotonic()
+        self._tokens = min(self.capacidad, self._tokens + (ahora - self._ultimo) * self.tasa)
+        self._ultimo = ahora
+
+    def adquirir(self) -> bool:
+        while True:
+            if self.cancelar and self.cancelar():
+                return False
+            with self._lock:
+                self._reponer()
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return True
+                espera = (1 - self._tokens) / self.tasa
+            esperar_cancelable(espera, self.cancelar)
+
+
+class ControlAIMD(LimitadorTasa):
+    def __init__(self, tasa: float = PETICIONES_POR_SEGUNDO, tasa_min: float = PETICIONES_POR_SEGUNDO_MIN,
+                 tasa_max: float = None, incremento: float = 0.5, factor: float = 0.5,
+                 latencia_objetivo: float = 2.0, ventana: int = 20, enfriamiento: float = 2.0,
+                 retry_after_max: float = 120.0, cancelar: Callable = None):
+        self.tasa_max = tasa if tasa_max is None else tasa_max
+        super().__init__(min(tasa, self.tasa_max), cancelar=cancelar)
+        self.tasa_min = tasa_min
+        self.incremento = incremento
+        self.factor = factor
+        self.latencia_objetivo = latencia_objetivo
+        self.ventana = ventana
+        self.enfriamiento = enfriamiento
+        self.retry_after_max = retry_after_max
+        self._sanas = 0
+        self._ultimo_recorte = 0.0
+        self._pausa_hasta = 0.0
+
+    def fijar_tasa(self, tasa: float, tasa_max: float = None):
+        with self._lock:
+            if tasa_max is not None:
+                self.tasa_max = tasa_max
+            self._cambiar_tasa(tasa)
+
+    def _cambiar_tasa(self, tasa: float):
+        self._reponer()
+        self.tasa = min(self.tasa_max, max(self.tasa_min, tasa))
+        self.capacidad = max(1.0, self.tasa)
+        self._tokens = min(self._tokens, self.capacidad)
+
+    def adquirir(self) -> bool:
+        while True:
+            if self.cancelar and self.cancelar():
+                return False
+            with self._lock:
+                espera = self._pausa_hasta - time.monotonic()
+            if espera <= 0:
+                break
+            esperar_cancelable(espera, self.cancelar)
+        return super().adquirir()
+
+    def registrar(self, status_code: Optional[int], latencia: float, retry_after: float = None, error: bool = False):
+        congestion = error or status_code == 429 or (status_code is not None and status_code >= 500)
+        with self._lock:
+            ahora = time.monotonic()
+            if retry_after:
+                self._pausa_hasta = max(self._pausa_hasta, ahora + min(retry_after, self.retry_after_max))
+            if congestion:
+                self._sanas = 0
+                # Las peticiones que ya estaban en vuelo fallan juntas; solo se recorta una vez por enfriamiento
+                if ahora - self._ultimo_recorte >= self.enfriamiento:
+                    self._ultimo_recorte = ahora
+                    self._cambiar_tasa(self.tasa * self.factor)
+                    logging.info(f"Servidor saturado ({status_code or 'error'}), tasa reducida a {self.tasa:.2f} req/s")
+            elif latencia > self.latencia_objetivo:
+                self._sanas = 0
+            else:
+                self._sanas += 1
+                if self._sanas >= self.ventana:
+                    self._sanas = 0
+                    self._cambiar_tasa(self.tasa + self.incremento)
+
+
+class CacheRespuestas:
+    def __init__(self, ruta: str, modo: str = 'grabar', nivel_compresion: int = 6):
+        if modo not in MODOS_CACHE:
+            raise ValueError(f"Modo de caché inválido: {modo}")
+        self.ruta = ruta
+        self.modo = modo
+        self.nivel_compresion = nivel_compresion
+        self._conn = None
+        self._lock = threading.Lock()
+        self._pendientes = {}
+        self._primer_pendiente = 0.0
+
+    @property
+    def reproduciendo(self) -> bool:
+        return self.modo == 'reproducir'
+
+    def _conexion(self) -> sqlite3.Connection:
+        if self._conn is None:
+            self._conn = sqlite3.connect(self.ruta, timeout=30, check_same_thread=False, isolation_level=None)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute('''
+                CREATE TABLE IF NOT EXISTS contenidos (
+                    hash TEXT PRIMARY KEY,
+                    datos BLOB NOT NULL
+                )
+            ''')
+            self._conn.execute('''
+                CREATE TABLE IF NOT EXISTS respuestas (
+                    clave TEXT PRIMARY KEY,
+                    endpoint TEXT NOT NULL,
+                    parametros TEXT NOT NULL,
+                    hash TEXT NOT NULL REFERENCES contenidos(hash),
+                    fecha TEXT NOT NULL
+                )
+            ''')
+        return self._conn
+
+    def _clave(self, endpoint: str, parametros: Dict) -> str:
+        return hash_payload([endpoint, parametros])
+
+    def guardar(self, endpoint: str, parametros: Dict, contenido: bytes):
+        if self.modo != 'grabar':
+            return
+        pendiente = (endpoint, json.dumps(parametros, sort_keys=True, ensure_ascii=False),
+                     hashlib.sha1(contenido).hexdigest(), zlib.compress(contenido, self.nivel_compresion),
+                     datetime.now().strftime('%Y-%m-%d %H:%M:%S'))
+        with self._lock:
+            if not self._pendientes:
+                self._primer_pendiente = time.monotonic()
+            self._pendientes[self._clave(endpoint, parametros)] = pendiente
+            if len(self._pendientes) >= RESPUESTAS_CACHE_POR_COMMIT or \
+                    time.monotonic() - self._primer_pendiente >= MS_POR_COMMIT_CACHE / 1000:
+                self._vaciar()
+
+    def vaciar(self):
+        with self._lock:
+            self._vaciar()
+
+    def _vaciar(self):
+        # Llamar con self._lock tomado
+        if not self._pendientes:
+            return
+        pendientes, self._pendientes = self._pendientes, {}
+        try:
+            conn = self._conexion()
+            conn.execute("BEGIN")
+            conn.executemany("INSERT OR IGNORE INTO contenidos (hash, datos) VALUES (?, ?)",
+                             [(hash_contenido, comprimido)
+                              for _, _, hash_contenido, comprimido, _ in pendientes.values()])
+            conn.executemany('''
+                INSERT INTO respuestas (clave, endpoint, parametros, hash, fecha) VALUES (?, ?, ?, ?, ?)
+                ON CONFLICT(clave) DO UPDATE SET hash = excluded.hash, fecha = excluded.fecha
+            ''', [(clave, endpoint, parametros, hash_contenido, fecha)
+                  for clave, (endpoint, parametros, hash_contenido, _, fecha) in pendientes.items()])
+            conn.execute("COMMIT")
+        except sqlite3.Error as e:
+            logging.error(f"Error al guardar {len(pendientes)} respuestas en caché: {e}")
+            if self._conn and self._conn.in_transaction:
+                self._conn.rollback()
+
+    def obtener(self, endpoint: str, parametros: Dict) -> Optional[bytes]:
+        if self.modo == 'desactivado':
+            return None
+        with self._lock:
+            clave = self._clave(endpoint, parametros)
+            if clave in self._pendientes:
+                return zlib.decompress(self._pendientes[clave][3])
+            fila = self._conexion().execute('''
+                SELECT c.datos FROM respuestas r JOIN contenidos c ON c.hash = r.hash WHERE r.clave = ?
+            ''', (clave,)).fetchone()
+        return zlib.decompress(fila[0]) if fila else None
+
+    def obtener_json(self, endpoint: str, parametros: Dict) -> Optional[Dict]:
+        contenido = self.obtener(endpoint, parametros)
+        return json.loads(contenido) if contenido else None
+
+    def cerrar(self):
+        with self._lock:
+            self._vaciar()
+            if self._conn:
+                self._conn.close()
+                self._conn = None
+
+
+class MemoriaVariantes:
+    def __init__(self, db: 'SCJNTesisDatabase'):
+        self.db = db
+        self._variantes = db.cargar_variantes_detalle()
+        self._lock = threading.Lock()
+        self._cambios = False
+        self.consultas = 0
+        self.aciertos = 0
+
+    @staticmethod
+    def clave(epoca: str, tesis: Dict) -> str:
+        return f"{epoca}|{(tesis.get('instanciaAbr') or '').strip()}"
+
+    def semanal_primero(self, clave: str) -> bool:
+        with self._lock:
+            variante = self._variantes.get(clave)
+            return bool(variante) and variante['exitos_semanal'] > variante['exitos_normal']
+
+    def registrar(self, clave: str, semanal: bool, primer_intento: bool):
+        with self._lock:
+            variante = self._variantes.setdefault(
+                clave, {'exitos_normal': 0, 'exitos_semanal': 0, 'consultas': 0, 'aciertos': 0})
+            variante['exitos_semanal' if semanal else 'exitos_normal'] += 1
+            variante['consultas'] += 1
+            variante['aciertos'] += primer_intento
+            self.consultas += 1
+            self.aciertos += primer_intento
+            self._cambios = True
+
+    def estadisticas(self) -> Dict:
+        with self._lock:
+            return {
+                'consultas': self.consultas,
+                'tasa_aciertos': round(self.aciertos / self.consultas, 3) if self.consultas else None,
+                'semanal_primero': sorted(clave for clave, v in self._variantes.items()
+                                          if v['exitos_semanal'] > v['exitos_normal'])
+            }
+
+    def guardar(self):
+        with self._lock:
+            if not self._cambios:
+                return
+            variantes = {clave: dict(v) for clave, v in self._variantes.items()}
+            self._cambios = False
+        self.db.guardar_variantes_detalle(variantes)
+
+
+class TrabajoPagina:
+    def __init__(self, epoca: str, tipo_tesis: str, pagina: int, documentos: List[Dict], total_documentos: int,
+                 sin_cambios: set, estadisticas: Dict, registrar: bool, al_terminar: Callable):
+        self.epoca = epoca
+        self.tipo_tesis = tipo_tesis
+        self.pagina = pagina
+        self.documentos = documentos
+        self.total_documentos = total_documentos
+        self.sin_cambios = sin_cambios
+        self.estadisticas = estadisticas
+        self.registrar = registrar
+        self.al_terminar = al_terminar
+        self.detalles = {}
+        self.tesis = []
+        self.detalles_procesados = []
+        self.completa = True
+        self.con_error = False
+        self.detalles_con_error = 0
+
+
+class PipelineExtraccion:
+    def __init__(self, extractor: 'SCJNTesisExtractor', workers_detalles: int = WORKERS_DETALLES,
+                 hilos_paginas: int = 2, docs_por_commit: int = DOCS_POR_COMMIT,
+                 ms_por_commit: int = MS_POR_COMMIT, capacidad: int = CAPACIDAD_COLAS_PIPELINE):
+        self.extractor = extractor
+        self.docs_por_commit = docs_por_commit
+        self.ms_por_commit = ms_por_commit
+        self.cola_detalles = queue.Queue(maxsize=capacidad)
+        self.cola_parseo = queue.Queue(maxsize=capacidad)
+        self.cola_escritura = queue.Queue(maxsize=capacidad)
+        self.pool_detalles = ThreadPoolExecutor(max_workers=workers_detalles, thread_name_prefix="detalles")
+        self._hilos_detalles = [threading.Thread(target=self._etapa_detalles, daemon=True, name=f"pipeline_detalles_{i}")
+                                for i in range(hilos_paginas)]
+        self._hilo_parseo = threading.Thread(target=self._etapa_parseo, daemon=True, name="pipeline_parseo")
+        self._hilo_escritura = threading.Thread(target=self._etapa_escritura, daemon=True, name="pipeline_escritura")
+        for hilo in self._hilos_detalles + [self._hilo_parseo, self._hilo_escritura]:
+            hilo.start()
+
+    def enviar(self, trabajo: TrabajoPagina):
+        self.cola_detalles.put(trabajo)
+
+    def cerrar(self):
+        for _ in self._hilos_detalles:
+            self.cola_detalles.put(None)
+        for hilo in self._hilos_detalles:
+            hilo.join()
+        self.cola_parseo.put(None)
+        self._hilo_parseo.join()
+        self._hilo_escritura.join()
+        self.pool_detalles.shutdown(wait=True)
+
+    def _etapa_detalles(self):
+        while True:
+            trabajo = self.cola_detalles.get()
+            if trabajo is None:
+                break
+            por_detallar = [doc for doc in trabajo.documentos
+                            if doc.get('ius') and str(doc.get('ius')) not in trabajo.sin_cambios]
+            try:
+                resultados = list(self.pool_detalles.map(
+                    lambda doc: self.extractor._obtener_detalle_crudo(doc, trabajo.epoca), por_detallar))
+                # Los detalles fallidos no se escriben: su hash_detalle queda vacío y se piden de nuevo
+                trabajo.detalles = {str(doc['ius']): crudo for doc, (crudo, error) in zip(por_detallar, resultados)
+                                    if not error}
+                trabajo.detalles_con_error = len(por_detallar) - len(trabajo.detalles)
+            except Exception as e:
+                logging.error(f"Error obteniendo detalles de la página {trabajo.pagina + 1}: {e}")
+                trabajo.detalles_con_error = len(por_detallar)
+            trabajo.con_error = trabajo.detalles_con_error > 0
+            if stop_extraction:
+                trabajo.completa = False
+            self.cola_parseo.put(trabajo)
+
+    def _etapa_parseo(self):
+        while True:
+            trabajo = self.cola_parseo.get()
+            if trabajo is None:
+                self.cola_escritura.put(None)
+                break
+            try:
+                trabajo.tesis = [self.extractor.procesar_tesis(doc, trabajo.epoca, trabajo.tipo_tesis)
+                                 for doc in trabajo.documentos]
+                for doc, tesis_procesada in zip(trabajo.documentos, trabajo.tesis):
+                    ius = str(doc.get('ius'))
+                    if ius in trabajo.detalles:
+                        detalle = self.extractor._procesar_detalle(doc, tesis_procesada, trabajo.detalles[ius])
+                        if detalle:
+                            trabajo.detalles_procesados.append(detalle)
+            except Exception as e:
+                logging.error(f"Error procesando la página {trabajo.pagina + 1}: {e}")
+                trabajo.tesis = []
+                trabajo.detalles_procesados = []
+                trabajo.con_error = True
+            self.cola_escritura.put(trabajo)
+
+    def _etapa_escritura(self):
+        pendientes = []
+        documentos = 0
+        inicio = 0.0
+        terminar = False
+        while not terminar:
+            espera = None
+            if pendientes:
+                espera = max(0.0, self.ms_por_commit / 1000 - (time.monotonic() - inicio))
+            try:
+                trabajo = self.cola_escritura.get(timeout=espera)
+            except queue.Empty:
+                trabajo = False
+            if trabajo is None:
+                terminar = True
+            elif trabajo:
+                if not pendientes:
+                    inicio = time.monotonic()
+                pendientes.append(trabajo)
+                documentos += len(trabajo.tesis)
+            if pendientes and (terminar or trabajo is False or documentos >= self.docs_por_commit):
+                self._guardar(pendientes)
+                pendientes = []
+                documentos = 0
+
+    def _guardar(self, trabajos: List[TrabajoPagina]):
+        try:
+            resultado = self.extractor.db.guardar_lote_extraccion(
+                [tesis for trabajo in trabajos for tesis in trabajo.tesis],
+                [detalle for trabajo in trabajos for detalle in trabajo.detalles_procesados],
+                [(trabajo.epoca, trabajo.tipo_tesis, trabajo.pagina, trabajo.total_documentos,
+                  'error' if trabajo.con_error else 'completada')
+                 for trabajo in trabajos if trabajo.completa and trabajo.registrar],
+                forzar=self.extractor.cache.reproduciendo
+            )
+            for trabajo in trabajos:
+                self._contabilizar(trabajo, resultado)
+        finally:
+            for trabajo in trabajos:
+                trabajo.al_terminar()
+
+    def _contabilizar(self, trabajo: TrabajoPagina, resultado: Optional[Tuple[set, set]]):
+        estadisticas = trabajo.estadisticas
+        with self.extractor.lock_estadisticas:
+            if resultado is None:
+                estadisticas['detalles_fallidos'] += len(trabajo.detalles_procesados)
+                estadisticas['paginas_con_error'] += 1
+                return
+            existentes, actualizadas = resultado
+            ius_pagina = {str(tesis['IUS']) for tesis in trabajo.tesis if tesis.get('IUS')}
+            estadisticas['tesis_nuevas'] += len(ius_pagina - existentes)
+            estadisticas['tesis_existentes'] += len(ius_pagina & existentes)
+            estadisticas['detalles_actualizados'] += len(
+                {str(detalle['IUS']) for detalle in trabajo.detalles_procesados} & actualizadas)
+            if trabajo.con_error:
+                estadisticas['paginas_con_error'] += 1
+                estadisticas['detalles_fallidos'] += trabajo.detalles_con_error
+            elif trabajo.completa:
+                estadisticas['paginas_procesadas'] += 1
 
 
 class SCJNTesisExtractor:
-    def __init__(self, db_path: str):
+    def __init__(self, db_path: str, peticiones_por_segundo: float = PETICIONES_POR_SEGUNDO,
+                 peticiones_por_segundo_max: float = None,
+                 workers_detalles: int = WORKERS_DETALLES,
+                 combinaciones_concurrentes: int = COMBINACIONES_CONCURRENTES,
+                 modo_cache: str = 'grabar', ruta_cache: str = None):
         self.base_url = "https://sjf2.scjn.gob.mx/services/sjftesismicroservice/api/public/tesis"
         self.detalle_url = "https://sjf2.scjn.gob.mx/services/sjftesismicroservice/api/public/tesis"
         self.headers = {
@@ -754,6 +2019,17 @@ class SCJNTesisExtractor:
         }
         self.db_path = db_path
         self.db = None
+        self.http = obtener_cliente_http(tamano_pool_http(workers_detalles, combinaciones_concurrentes))
+        self.limitador = ControlAIMD(peticiones_por_segundo, tasa_max=peticiones_por_segundo_max,
+                                     cancelar=self._cancelar_extraccion)
+        self.workers_detalles = workers_detalles
+        self.combinaciones_concurrentes = combinaciones_concurrentes
+        self.lock_estadisticas = threading.Lock()
+        self.variantes = None
+        self.cache = CacheRespuestas(
+            ruta_cache or os.path.join(os.path.dirname(os.path.abspath(db_path)), "cache_respuestas.db"),
+            modo_cache
+        )
         self.configuraciones_epocas = {
             "9na_epoca": {
                 "idEpoca": ["5"],
@@ -785,6 +2061,7 @@ class SCJNTesisExtractor:
     def init_db(self):
         if self.db is None:
             self.db = SCJNTesisDatabase(self.db_path)
+            self.variantes = MemoriaVariantes(self.db)
 
     def construir_payload(self, epoca: str, tipo_tesis: str):
         config = self.configuraciones_epocas[epoca]
@@ -804,9 +2081,13 @@ class SCJNTesisExtractor:
         }
         return payload
 
+    def hash_listado(self, tesis_data: Dict, epoca: str, tipo_tesis: str) -> str:
+        return hash_payload([VERSION_PARSER, tesis_data, epoca, tipo_tesis])
+
     def procesar_tesis(self, tesis_data: Dict, epoca: str, tipo_tesis: str) -> Dict:
         detalles = self.extraer_detalles_localizacion(tesis_data.get('localizacion', ''))
         tesis_procesada = {
+            'Hash_Contenido': self.hash_listado(tesis_data, epoca, tipo_tesis),
             'IUS': tesis_data.get('ius'),
             'ID': tesis_data.get('id'),
             'Rubro': self.limpiar_html(tesis_data.get('rubro', '')).strip(),
@@ -835,20 +2116,37 @@ class SCJNTesisExtractor:
         return tesis_procesada
 
     def obtener_detalles_tesis(self, ius: str) -> Optional[Dict]:
-        url_sin_semanal = f"{self.detalle_url}/{ius}?hostName=https://sjf2.scjn.gob.mx"
+        detalles, _ = self._pedir_detalle(ius)
+        return detalles
+
+    def _cancelar_extraccion(self) -> bool:
+        return stop_extraction
+
+    def _pedir_detalle(self, ius: str, clave_variante: str = None) -> Tuple[Optional[Dict], bool]:
+        # (detalles, error): un 404 en ambas variantes es "sin detalle", no un error
         try:
-            response = requests.get(url_sin_semanal, headers=self.headers, timeout=30)
-            if response.status_code == 200:
-                return response.json()
-            elif response.status_code == 404:
-                url_con_semanal = f"{self.detalle_url}/{ius}?isSemanal=true&hostName=https://sjf2.scjn.gob.mx"
-                response2 = requests.get(url_con_semanal, headers=self.headers, timeout=30)
-                if response2.status_code == 200:
-                    return response2.json()
-            return None
+            if self.cache.reproduciendo:
+                return (self.cache.obtener_json('detalle', {'ius': str(ius), 'semanal': False})
+                        or self.cache.obtener_json('detalle', {'ius': str(ius), 'semanal': True})), False
+            semanal_primero = bool(clave_variante) and self.variantes.semanal_primero(clave_variante)
+            for intento, semanal in enumerate((True, False) if semanal_primero else (False, True)):
+                url = (f"{self.detalle_url}/{ius}?isSemanal=true&hostName=https://sjf2.scjn.gob.mx" if semanal
+                       else f"{self.detalle_url}/{ius}?hostName=https://sjf2.scjn.gob.mx")
+                response = self.http.request_con_reintentos('GET', url, control=self.limitador,
+                                                            cancelar=self._cancelar_extraccion, headers=self.headers)
+                if response is None:
+                    return None, True
+                if response.status_code == 200:
+                    self.cache.guardar('detalle', {'ius': str(ius), 'semanal': semanal}, response.content)
+                    if clave_variante:
+                        self.variantes.registrar(clave_variante, semanal, intento == 0)
+                    return response.json(), False
+                if response.status_code != 404:
+                    return None, True
+            return None, False
         except Exception as e:
             logging.debug(f"Error al obtener detalles para IUS {ius}: {e}")
-            return None
+            return None, True
 
     def procesar_detalles_tesis(self, detalles: Dict) -> Dict:
         if not detalles:
@@ -941,155 +2239,367 @@ class SCJNTesisExtractor:
         return mapeo.get(tipo, f"Desconocido ({tipo})")
 
     def obtener_pagina(self, epoca: str, tipo_tesis: str, pagina: int, size: int = 50) -> Optional[Dict]:
+        datos, _ = self._pedir_pagina(epoca, tipo_tesis, pagina, size)
+        return datos
+
+    def _pedir_pagina(self, epoca: str, tipo_tesis: str, pagina: int, size: int = 50) -> Tuple[Optional[Dict], bool]:
+        # (datos, error): datos None sin error significa que la combinación ya no tiene más documentos
         try:
             payload = self.construir_payload(epoca, tipo_tesis)
             params = {'page': pagina, 'size': size}
-            response = requests.post(self.base_url, headers=self.headers, params=params, json=payload, timeout=30)
-            if response.status_code == 200:
-                datos = response.json()
-                if datos.get('documents'):
-                    return datos
-            return None
+            parametros_cache = {'params': params, 'payload': payload}
+            if self.cache.reproduciendo:
+                datos = self.cache.obtener_json('pagina', parametros_cache)
+                return (datos if datos and datos.get('documents') else None), False
+            response = self.http.request_con_reintentos('POST', self.base_url, control=self.limitador,
+                                                        cancelar=self._cancelar_extraccion, headers=self.headers,
+                                                        params=params, json=payload)
+            if response is None or response.status_code != 200:
+                logging.error(f"Error al obtener página {pagina+1} de {epoca} - {tipo_tesis}: "
+                              f"{response.status_code if response is not None else 'sin respuesta'}")
+                return None, True
+            self.cache.guardar('pagina', parametros_cache, response.content)
+            datos = response.json()
+            return (datos if datos.get('documents') else None), False
         except Exception as e:
             logging.error(f"Error al obtener página {pagina+1}: {e}")
+            return None, True
+
+    def _obtener_detalle_crudo(self, tesis: Dict, epoca: str = None) -> Tuple[Optional[Dict], bool]:
+        try:
+            if stop_extraction:
+                return None, False
+            return self._pedir_detalle(tesis.get('ius'), MemoriaVariantes.clave(epoca, tesis) if epoca else None)
+        except Exception as e:
+            logging.error(f"Error obteniendo detalle de tesis individual: {e}")
+            return None, True
+
+    def _procesar_detalle(self, tesis: Dict, tesis_procesada: Dict, detalles: Optional[Dict]) -> Optional[Dict]:
+        try:
+            ius = tesis_procesada['IUS']
+            if not ius or stop_extraction:
+                return None
+            if detalles:
+                detalles_procesados = self.procesar_detalles_tesis(detalles)
+                detalles_procesados['IUS'] = ius
+                detalles_procesados['Hash_Detalle'] = hash_payload([VERSION_PARSER, detalles])
+                return detalles_procesados
+            if self.cache.reproduciendo:
+                return None
+            self.completar_con_datos_principales(tesis_procesada, tesis)
+            return {
+                'IUS': ius,
+                'Precedentes': tesis_procesada.get('Precedentes', ''),
+                'Materias': tesis_procesada.get('Materias', ''),
+                'Ejecutorias': tesis_procesada.get('Ejecutorias', ''),
+                'Votos': tesis_procesada.get('Votos', ''),
+                'Volumen': tesis_procesada.get('Volumen', '')
+            }
+        except Exception as e:
+            logging.error(f"Error procesando tesis individual: {e}")
             return None
 
     def procesar_epoca_tipo(self, epoca: str, tipo_tesis: str, size: int = 50, max_paginas: int = 1000,
                            combinacion_actual: int = 0, total_combinaciones: int = 0,
-                           callback_progreso=None) -> Dict:
+                           callback_progreso=None, modo_sync: bool = False,
+                           umbral_sin_cambios: int = UMBRAL_SYNC_SIN_CAMBIOS,
+                           pipeline: PipelineExtraccion = None) -> Dict:
         if self.db is None:
             self.init_db()
         estadisticas = {
             'total_paginas': 0, 'tesis_nuevas': 0, 'tesis_existentes': 0,
             'detalles_actualizados': 0, 'detalles_fallidos': 0,
-            'paginas_procesadas': 0, 'paginas_omitidas': 0, 'error': False
+            'paginas_procesadas': 0, 'paginas_omitidas': 0, 'paginas_con_error': 0,
+            'tesis_sin_cambios': 0, 'error': False
+        }
+        pipeline_propio = pipeline is None
+        if pipeline_propio:
+            pipeline = PipelineExtraccion(self, self.workers_detalles)
+        en_vuelo = threading.Semaphore(PAGINAS_EN_VUELO_POR_COMBINACION)
+        contexto = {
+            'epoca': epoca, 'tipo_tesis': tipo_tesis, 'size': size, 'estadisticas': estadisticas,
+            'pipeline': pipeline, 'en_vuelo': en_vuelo, 'callback_progreso': callback_progreso,
+            'combinacion': f"({combinacion_actual}/{total_combinaciones})", 'max_paginas': max_paginas,
+            'detener': threading.Event()
         }
-        pagina = 0
-        contador_commit = 0
         try:
+            if modo_sync:
+                self._recorrer_sync(contexto, umbral_sin_cambios)
+            else:
+                self._recorrer_planificado(contexto)
+        except Exception as e:
+            logging.error(f"Error durante el procesamiento: {e}")
+            estadisticas['error'] = True
+        finally:
+            for _ in range(PAGINAS_EN_VUELO_POR_COMBINACION):
+                en_vuelo.acquire()
+            if pipeline_propio:
+                pipeline.cerrar()
+            self.variantes.guardar()
+        return estadisticas
+
+    def _avisar_progreso(self, contexto: Dict, pagina: int) -> bool:
+        if stop_extraction or contexto['detener'].is_set():
+            return False
+        if contexto['callback_progreso']:
+            total = contexto['estadisticas']['total_paginas'] or contexto['max_paginas']
+            resultado = contexto['callback_progreso'](
+                pagina, total,
+                f"{contexto['epoca'].replace('_', ' ')} - {contexto['tipo_tesis']} - Página {pagina+1} de {total} - "
+                f"{contexto['combinacion']}")
+            if resultado is None or resultado is False:
+                contexto['detener'].set()
+                return False
+        return True
+
+    def _pagina_fallida(self, contexto: Dict, pagina: int, registrar: bool):
+        with self.lock_estadisticas:
+            contexto['estadisticas']['paginas_con_error'] += 1
+        if registrar:
+            self.db.registrar_extraccion(contexto['epoca'], contexto['tipo_tesis'], pagina, 0, 'error')
+
+    def _entregar_pagina(self, contexto: Dict, pagina: int, documentos: List[Dict], total_documentos: int,
+                         sin_cambios: set, registrar: bool):
+        contexto['en_vuelo'].acquire()
+        contexto['pipeline'].enviar(TrabajoPagina(contexto['epoca'], contexto['tipo_tesis'], pagina, documentos,
+                                                  total_documentos, sin_cambios, contexto['estadisticas'],
+                                                  registrar, contexto['en_vuelo'].release))
+
+    def _sin_cambios(self, documentos: List[Dict], epoca: str, tipo_tesis: str) -> Tuple[List[Dict], set]:
+        listado = [{'IUS': tesis.get('ius'), 'Hash_Contenido': self.hash_listado(tesis, epoca, tipo_tesis)}
+                   for tesis in documentos]
+        if self.cache.reproduciendo:
+            return listado, set()
+        return listado, self.db.tesis_sin_cambios(listado)
+
+    def _recorrer_planificado(self, contexto: Dict):
+        epoca, tipo_tesis, size = contexto['epoca'], contexto['tipo_tesis'], contexto['size']
+        estadisticas = contexto['estadisticas']
+        completadas = set() if self.cache.reproduciendo else self.db.paginas_completadas(epoca, tipo_tesis)
+        if not self._avisar_progreso(contexto, 0):
+            estadisticas['error'] = stop_extraction
+            return
+        datos, error_pagina = self._pedir_pagina(epoca, tipo_tesis, 0, size)
+        if error_pagina:
+            self._pagina_fallida(contexto, 0, True)
+            estadisticas['error'] = True
+            return
+        if not datos:
+            return
+        total_paginas = datos.get('totalPage', 0) or 1
+        if contexto['max_paginas']:
+            total_paginas = min(total_paginas, contexto['max_paginas'])
+        estadisticas['total_paginas'] = total_paginas
+        if 0 in completadas:
+            estadisticas['paginas_omitidas'] += 1
+        else:
+            documentos = datos['documents']
+            _, sin_cambios = self._sin_cambios(documentos, epoca, tipo_tesis)
+            self._entregar_pagina(contexto, 0, documentos, len(documentos), sin_cambios, True)
+        faltantes = queue.SimpleQueue()
+        for pagina in range(1, total_paginas):
+            if pagina in completadas:
+                estadisticas['paginas_omitidas'] += 1
+            else:
+                faltantes.put(pagina)
+
+        def trabajador():
             while True:
-                global stop_extraction
-                if stop_extraction:
-                    estadisticas['error'] = True
-                    break
-                if max_paginas and pagina >= max_paginas:
-                    break
-                if self.db.pagina_procesada(epoca, tipo_tesis, pagina):
-                    pagina += 1
-                    estadisticas['paginas_omitidas'] += 1
+                try:
+                    pagina = faltantes.get_nowait()
+                except queue.Empty:
+                    return
+                if not self._avisar_progreso(contexto, pagina):
+                    return
+                datos, error_pagina = self._pedir_pagina(epoca, tipo_tesis, pagina, size)
+                if error_pagina:
+                    self._pagina_fallida(contexto, pagina, True)
                     continue
-                if callback_progreso:
-                    resultado = callback_progreso(pagina, max_paginas,
-                                                f"{epoca.replace('_', ' ')} - {tipo_tesis} - Página {pagina+1} - ({combinacion_actual}/{total_combinaciones})")
-                    if resultado is None or resultado is False:
-                        break
-                datos = self.obtener_pagina(epoca, tipo_tesis, pagina, size)
                 if not datos:
+                    # totalPage era mayor que lo que hay realmente; no quedan más páginas útiles
+                    continue
+                documentos = datos['documents']
+                _, sin_cambios = self._sin_cambios(documentos, epoca, tipo_tesis)
+                self._entregar_pagina(contexto, pagina, documentos, len(documentos), sin_cambios, True)
+
+        with ThreadPoolExecutor(max_workers=HILOS_PAGINAS_POR_COMBINACION) as executor:
+            for futuro in [executor.submit(trabajador) for _ in range(HILOS_PAGINAS_POR_COMBINACION)]:
+                futuro.result()
+        if stop_extraction:
+            estadisticas['error'] = True
+
+    def _recorrer_sync(self, contexto: Dict, umbral_sin_cambios: int):
+        epoca, tipo_tesis, size = contexto['epoca'], contexto['tipo_tesis'], contexto['size']
+        estadisticas = contexto['estadisticas']
+        pagina = 0
+        consecutivas_sin_cambios = 0
+        while True:
+            if not self._avisar_progreso(contexto, pagina):
+                estadisticas['error'] = stop_extraction
+                break
+            if contexto['max_paginas'] and pagina >= contexto['max_paginas']:
+                break
+            datos, error_pagina = self._pedir_pagina(epoca, tipo_tesis, pagina, size)
+            if error_pagina:
+                # Las páginas se desplazan al entrar tesis nuevas; en modo_sync no se guardan checkpoints
+                self._pagina_fallida(contexto, pagina, False)
+                if stop_extraction or not estadisticas['total_paginas']:
+                    estadisticas['error'] = True
                     break
-                documentos = datos.get('documents', [])
-                if not documentos:
-                    break
-                for tesis in documentos:
-                    try:
-                        if stop_extraction:
-                            break
-                        tesis_procesada = self.procesar_tesis(tesis, epoca, tipo_tesis)
-                        if self.db.insert_tesis(tesis_procesada):
-                            estadisticas['tesis_nuevas'] += 1
-                        else:
-                            estadisticas['tesis_existentes'] += 1
-                        ius = tesis_procesada['IUS']
-                        if ius:
-                            detalles = self.obtener_detalles_tesis(ius)
-                            if detalles:
-                                detalles_procesados = self.procesar_detalles_tesis(detalles)
-                                detalles_procesados['IUS'] = ius
-                            else:
-                                self.completar_con_datos_principales(tesis_procesada, tesis)
-                                detalles_procesados = {
-                                    'IUS': ius,
-                                    'Precedentes': tesis_procesada.get('Precedentes', ''),
-                                    'Materias': tesis_procesada.get('Materias', ''),
-                                    'Ejecutorias': tesis_procesada.get('Ejecutorias', ''),
-                                    'Votos': tesis_procesada.get('Votos', ''),
-                                    'Volumen': tesis_procesada.get('Volumen', '')
-                                }
-                            if self.db.actualizar_tesis_detalles(detalles_procesados):
-                                estadisticas['detalles_actualizados'] += 1
-                            else:
-                                estadisticas['detalles_fallidos'] += 1
-                        time.sleep(0.3)
-                    except Exception as e:
-                        logging.error(f"Error procesando tesis individual: {e}")
-                        continue
-                if stop_extraction:
-                    break
-                self.db.registrar_extraccion(epoca, tipo_tesis, pagina, len(documentos), 'completada')
-                estadisticas['paginas_procesadas'] += 1
-                contador_commit += 1
-                if contador_commit % 5 == 0:
-                    self.db.conn.commit()
-                total_paginas_api = datos.get('totalPage', 0)
-                if total_paginas_api > 0:
-                    estadisticas['total_paginas'] = total_paginas_api
-                if pagina >= total_paginas_api - 1:
+                if pagina >= estadisticas['total_paginas'] - 1:
                     break
                 pagina += 1
-                time.sleep(0.5)
-        except Exception as e:
-            logging.error(f"Error durante el procesamiento: {e}")
-            estadisticas['error'] = True
-        if contador_commit % 5 != 0:
-            self.db.conn.commit()
-        return estadisticas
+                continue
+            if not datos:
+                break
+            documentos = datos['documents']
+            listado, sin_cambios = self._sin_cambios(documentos, epoca, tipo_tesis)
+            pendientes = []
+            alcanzado_umbral = False
+            for tesis, resumen in zip(documentos, listado):
+                if str(resumen['IUS']) in sin_cambios:
+                    consecutivas_sin_cambios += 1
+                    estadisticas['tesis_sin_cambios'] += 1
+                    if consecutivas_sin_cambios >= umbral_sin_cambios:
+                        if self._sync_al_dia(contexto, datos):
+                            alcanzado_umbral = True
+                            break
+                        consecutivas_sin_cambios = 0
+                else:
+                    consecutivas_sin_cambios = 0
+                    pendientes.append(tesis)
+            self._entregar_pagina(contexto, pagina, pendientes, len(documentos), sin_cambios, False)
+            if alcanzado_umbral:
+                break
+            total_paginas_api = datos.get('totalPage', 0)
+            if total_paginas_api > 0:
+                estadisticas['total_paginas'] = total_paginas_api
+            if pagina >= total_paginas_api - 1:
+                break
+            pagina += 1
+
+    def _sync_al_dia(self, contexto: Dict, datos: Dict) -> bool:
+        # La API no documenta su orden: solo se corta si ya están guardados todos los documentos que reporta
+        epoca, tipo_tesis, size = contexto['epoca'], contexto['tipo_tesis'], contexto['size']
+        if 'documentos_api' not in contexto:
+            total_paginas = datos.get('totalPage', 0)
+            if total_paginas <= 0:
+                return False
+            ultima, error = self._pedir_pagina(epoca, tipo_tesis, total_paginas - 1, size)
+            if error:
+                return False
+            contexto['documentos_api'] = (total_paginas - 1) * size + len(ultima['documents'] if ultima else [])
+        guardadas = self.db.contar_tesis_combinacion(epoca.replace('_', ' ').title(), tipo_tesis.title())
+        if guardadas >= contexto['documentos_api']:
+            return True
+        logging.info(f"{epoca} - {tipo_tesis}: {guardadas} de {contexto['documentos_api']} tesis guardadas, "
+                     f"se sigue paginando")
+        return False
 
     def extraer_todas_epocas_y_tipos(self, size: int = 50, max_paginas_por_consulta: int = 1000,
-                                      forzar_reextraccion: bool = False, callback_progreso=None):
+                                      forzar_reextraccion: bool = False, callback_progreso=None,
+                                      modo_sync: bool = False, umbral_sin_cambios: int = UMBRAL_SYNC_SIN_CAMBIOS):
         if self.db is None:
             self.init_db()
         if forzar_reextraccion:
             self.db.limpiar_control_extracciones()
-        total_consultas = len(self.configuraciones_epocas) * len(self.tipos_tesis)
-        consulta_actual = 0
+        combinaciones = [(epoca_nombre, tipo_nombre)
+                         for epoca_nombre in self.configuraciones_epocas.keys()
+                         for tipo_nombre in self.tipos_tesis.keys()]
+        total_consultas = len(combinaciones)
         estadisticas_totales = {
             'total_tesis_nuevas': 0, 'total_tesis_existentes': 0,
             'total_detalles_actualizados': 0, 'total_detalles_fallidos': 0,
-            'total_paginas_procesadas': 0, 'total_paginas_omitidas': 0,
+            'total_paginas_procesadas': 0, 'total_paginas_omitidas': 0, 'total_paginas_con_error': 0,
+            'total_tesis_sin_cambios': 0,
             'consultas_completadas': 0, 'consultas_con_error': 0
         }
-        for epoca_nombre in self.configuraciones_epocas.keys():
-            for tipo_nombre in self.tipos_tesis.keys():
-                consulta_actual += 1
-                if callback_progreso:
-                    callback_progreso(consulta_actual, total_consultas,
-                                     f"Extrayendo {epoca_nombre.replace('_', ' ')} - {tipo_nombre}... ({consulta_actual}/{total_consultas})",
-                                     consulta_actual / total_consultas)
-                stats = self.procesar_epoca_tipo(
-                    epoca=epoca_nombre, tipo_tesis=tipo_nombre, size=size,
-                    max_paginas=max_paginas_por_consulta,
-                    combinacion_actual=consulta_actual, total_combinaciones=total_consultas,
-                    callback_progreso=callback_progreso
-                )
+        avance = {combinacion: 0.0 for combinacion in combinaciones}
+        paginas_en_curso = [0]
+        lock_progreso = threading.Lock()
+
+        def notificar(mensaje: str):
+            with lock_progreso:
+                terminadas = estadisticas_totales['consultas_completadas'] + estadisticas_totales['consultas_con_error']
+                progreso_general = sum(avance.values()) / total_consultas
+                paginas = paginas_en_curso[0]
+            if not callback_progreso:
+                return True
+            return callback_progreso(terminadas, total_consultas,
+                                     f"{mensaje} - {paginas} páginas ({terminadas}/{total_consultas} combinaciones)"
+                                     f" - {self.limitador.tasa:.1f} req/s",
+                                     progreso_general)
+
+        def progreso_combinacion(combinacion):
+            def callback(pagina, total_paginas, mensaje):
+                with lock_progreso:
+                    paginas_en_curso[0] += 1
+                    if total_paginas:
+                        avance[combinacion] = min(pagina / total_paginas, 0.99)
+                return notificar(mensaje)
+            return callback
+
+        def extraer_combinacion(indice, combinacion):
+            epoca_nombre, tipo_nombre = combinacion
+            if stop_extraction:
+                return None
+            stats = self.procesar_epoca_tipo(
+                epoca=epoca_nombre, tipo_tesis=tipo_nombre, size=size,
+                max_paginas=max_paginas_por_consulta,
+                combinacion_actual=indice, total_combinaciones=total_consultas,
+                callback_progreso=progreso_combinacion(combinacion),
+                modo_sync=modo_sync, umbral_sin_cambios=umbral_sin_cambios,
+                pipeline=pipeline
+            )
+            with lock_progreso:
+                avance[combinacion] = 1.0
                 estadisticas_totales['total_tesis_nuevas'] += stats['tesis_nuevas']
                 estadisticas_totales['total_tesis_existentes'] += stats['tesis_existentes']
                 estadisticas_totales['total_detalles_actualizados'] += stats['detalles_actualizados']
                 estadisticas_totales['total_detalles_fallidos'] += stats['detalles_fallidos']
                 estadisticas_totales['total_paginas_procesadas'] += stats['paginas_procesadas']
                 estadisticas_totales['total_paginas_omitidas'] += stats['paginas_omitidas']
+                estadisticas_totales['total_paginas_con_error'] += stats['paginas_con_error']
+                estadisticas_totales['total_tesis_sin_cambios'] += stats['tesis_sin_cambios']
                 if stats['error']:
                     estadisticas_totales['consultas_con_error'] += 1
                 else:
                     estadisticas_totales['consultas_completadas'] += 1
-                global stop_extraction
-                if stop_extraction:
-                    break
-                time.sleep(1)
-            if stop_extraction:
-                break
-        self.db.actualizar_resumenes()
+            notificar(f"Terminada {epoca_nombre.replace('_', ' ')} - {tipo_nombre}")
+            return stats
+
+        pipeline = PipelineExtraccion(self, self.workers_detalles)
+        try:
+            with ThreadPoolExecutor(max_workers=self.combinaciones_concurrentes,
+                                    thread_name_prefix="combinacion") as pool_combinaciones:
+                futuros = [pool_combinaciones.submit(extraer_combinacion, indice, combinacion)
+                           for indice, combinacion in enumerate(combinaciones, start=1)]
+                for futuro in futuros:
+                    try:
+                        futuro.result()
+                    except Exception as e:
+                        logging.error(f"Error en combinación de extracción: {e}")
+                        with lock_progreso:
+                            estadisticas_totales['consultas_con_error'] += 1
+        finally:
+            pipeline.cerrar()
+            self.cache.vaciar()
+        estadisticas_totales['http'] = self.http.estadisticas()
+        estadisticas_totales['variantes_detalle'] = self.variantes.estadisticas()
+        logging.info(f"Estadísticas HTTP de la extracción: {estadisticas_totales['http']}")
+        logging.info(f"Variantes de detalle: {estadisticas_totales['variantes_detalle']}")
         return estadisticas_totales
 
+    def reconstruir_desde_cache(self, size: int = 50, callback_progreso=None) -> Dict:
+        modo_previo = self.cache.modo
+        self.cache.modo = 'reproducir'
+        try:
+            return self.extraer_todas_epocas_y_tipos(size=size, callback_progreso=callback_progreso)
+        finally:
+            self.cache.modo = modo_previo
+
     def cerrar(self):
+        self.cache.cerrar()
         if self.db:
             self.db.close()
             self.db = None
@@ -1099,6 +2609,7 @@ class DescargadorTesis:
     def __init__(self, db_path: str):
         self.db_path = db_path
         self.base_carpeta = "tesis_descargadas"
+        self.control = ControlAIMD(tasa=1.0, cancelar=lambda: stop_download)
 
     def crear_estructura_carpetas(self):
         if not os.path.exists(self.base_carpeta):
@@ -1123,7 +2634,27 @@ class DescargadorTesis:
                 break
         return os.path.join(self.base_carpeta, epoca_normalizada)
 
+    @staticmethod
+    def validar_pdf(ruta: str, tamano_esperado: int = None) -> bool:
+        try:
+            tamano = os.path.getsize(ruta)
+            if tamano < 8 or (tamano_esperado is not None and tamano != tamano_esperado):
+                return False
+            with open(ruta, 'rb') as f:
+                if f.read(5) != b'%PDF-':
+                    return False
+                f.seek(max(0, tamano - 1024))
+                return b'%%EOF' in f.read()
+        except OSError:
+            return False
+
     def descargar_tesis(self, ius: str, epoca_config: str) -> Tuple[bool, str]:
+        exito, ruta, _, _ = self._descargar_pdf(ius, epoca_config)
+        return exito, ruta
+
+    def _descargar_pdf(self, ius: str, epoca_config: str,
+                       reintentos: int = REINTENTOS_HTTP) -> Tuple[bool, str, Optional[int], str]:
+        # (exito, ruta, status HTTP, error)
         url_base = f"https://sjf2.scjn.gob.mx/services/sjftesismicroservice/api/public/tesis/reporte/{ius}"
         params = {
             "nameDocto": "Tesis",
@@ -1138,85 +2669,266 @@ class DescargadorTesis:
                 'Accept-Language': 'es-ES,es;q=0.9,en;q=0.8',
                 'Referer': 'https://sjf2.scjn.gob.mx/'
             }
-            response = requests.get(url_base, params=params, headers=headers, timeout=30)
-            if response.status_code == 200:
-                if not os.path.exists(self.base_carpeta):
-                    self.crear_estructura_carpetas()
-                carpeta_epoca = self.obtener_carpeta_epoca(epoca_config)
-                nombre_archivo = f"tesis_{ius}.pdf"
-                ruta_completa = os.path.join(carpeta_epoca, nombre_archivo)
-                with open(ruta_completa, 'wb') as f:
-                    f.write(response.content)
-                return True, ruta_completa
-            else:
-                return False, ""
+            response = obtener_cliente_http().request_con_reintentos(
+                'GET', url_base, control=self.control, reintentos=reintentos, cancelar=lambda: stop_download,
+                params=params, headers=headers, stream=True)
+        except Exception as e:
+            logging.error(f"Error al descargar tesis {ius}: {e}")
+            return False, "", None, str(e)
+        if response is None:
+            return False, "", None, "sin respuesta del servidor"
+
+        ruta_temporal = None
+        try:
+            if response.status_code != 200:
+                return False, "", response.status_code, f"HTTP {response.status_code}"
+            if not os.path.exists(self.base_carpeta):
+                self.crear_estructura_carpetas()
+            carpeta_epoca = self.obtener_carpeta_epoca(epoca_config)
+            os.makedirs(carpeta_epoca, exist_ok=True)
+            ruta_completa = os.path.join(carpeta_epoca, f"tesis_{ius}.pdf")
+            ruta_temporal = f"{ruta_completa}.{threading.get_ident()}.part"
+            escritos = 0
+            with open(ruta_temporal, 'wb') as f:
+                for bloque in response.iter_content(chunk_size=TAMANO_BLOQUE_DESCARGA):
+                    f.write(bloque)
+                    escritos += len(bloque)
+            # Con compresión, Content-Length mide el cuerpo comprimido y no sirve para comparar
+            tamano_esperado = None
+            if response.headers.get('Content-Length', '').isdigit() and \
+                    response.headers.get('Content-Encoding', 'identity') == 'identity':
+                tamano_esperado = int(response.headers['Content-Length'])
+            if not self.validar_pdf(ruta_temporal, tamano_esperado):
+                logging.error(f"PDF de la tesis {ius} incompleto o inválido ({escritos} bytes"
+                              f"{f' de {tamano_esperado}' if tamano_esperado is not None else ''})")
+                return False, "", response.status_code, f"PDF inválido ({escritos} bytes)"
+            os.replace(ruta_temporal, ruta_completa)
+            ruta_temporal = None
+            return True, ruta_completa, response.status_code, ""
         except Exception as e:
             logging.error(f"Error al descargar tesis {ius}: {e}")
-            return False, ""
+            return False, "", response.status_code, str(e)
+        finally:
+            response.close()
+            if ruta_temporal and os.path.exists(ruta_temporal):
+                try:
+                    os.remove(ruta_temporal)
+                except OSError:
+                    pass
+
+    def escanear_pdfs(self) -> Dict[str, Dict[str, str]]:
+        archivos = {}
+        if not os.path.isdir(self.base_carpeta):
+            return archivos
+        with os.scandir(self.base_carpeta) as carpetas:
+            for carpeta in carpetas:
+                if not carpeta.is_dir():
+                    continue
+                encontrados = archivos.setdefault(os.path.normcase(os.path.abspath(carpeta.path)), {})
+                with os.scandir(carpeta.path) as entradas:
+                    for entrada in entradas:
+                        coincidencia = re.fullmatch(r'tesis_(\d+)\.pdf', entrada.name)
+                        if not coincidencia or not entrada.is_file():
+                            continue
+                        encontrados[coincidencia.group(1)] = entrada.path
+        return archivos
+
+    def _descartar_pdf(self, ruta: str):
+        logging.warning(f"PDF incompleto o inválido, se borra para descargarlo de nuevo: {ruta}")
+        try:
+            os.remove(ruta)
+        except OSError as e:
+            logging.error(f"No se pudo borrar {ruta}: {e}")
+
+    def reconciliar_descargas(self, validar: bool = False) -> Dict[str, int]:
+        archivos = self.escanear_pdfs()
+        rutas = {os.path.normcase(os.path.abspath(ruta))
+                 for encontrados in archivos.values() for ruta in encontrados.values()}
+        db = SCJNTesisDatabase.conexion_rapida(self.db_path)
+        encontradas = []
+        perdidas = []
+        invalidas = 0
+        for ius, descargado, ubicacion, epoca_config in db.estado_descargas():
+            ius = str(ius)
+            if descargado and ubicacion and os.path.normcase(os.path.abspath(ubicacion)) in rutas:
+                if not validar or self.validar_pdf(ubicacion):
+                    continue
+                self._descartar_pdf(ubicacion)
+                invalidas += 1
+                perdidas.append(ius)
+                continue
+            carpeta = os.path.normcase(os.path.abspath(self.obtener_carpeta_epoca(epoca_config)))
+            ruta = archivos.get(carpeta, {}).get(ius) or next(
+                (encontrados[ius] for encontrados in archivos.values() if ius in encontrados), None)
+            if ruta and not self.validar_pdf(ruta):
+                self._descartar_pdf(ruta)
+                invalidas += 1
+                ruta = None
+            if ruta:
+                encontradas.append((ius, ruta))
+            elif descargado and not (ubicacion and os.path.exists(ubicacion)):
+                perdidas.append(ius)
+        exito = db.reconciliar_descargas(encontradas, perdidas) if encontradas or perdidas else True
+        db.close()
+        resultado = {'archivos': len(rutas), 'registradas': len(encontradas), 'perdidas': len(perdidas),
+                     'invalidas': invalidas}
+        if exito:
+            logging.info(f"Reconciliación de descargas: {resultado}")
+        return resultado
 
-    def descargar_tesis_individual(self, ius: str, epoca_config: str) -> Tuple[bool, str]:
-        db = SCJNTesisDatabase(self.db_path)
+    def descargar_tesis_individual(self, ius: str, epoca_config: str,
+                                   reintentos: int = REINTENTOS_HTTP) -> Tuple[bool, str]:
+        db = SCJNTesisDatabase.conexion_rapida(self.db_path)
         descargado, ubicacion_bd = db.verificar_estado_descarga(ius)
         carpeta_epoca = self.obtener_carpeta_epoca(epoca_config)
         ruta_esperada = os.path.join(carpeta_epoca, f"tesis_{ius}.pdf")
-        if descargado and ubicacion_bd and os.path.exists(ubicacion_bd):
+        if descargado and ubicacion_bd and self.validar_pdf(ubicacion_bd):
             db.close()
             return True, ubicacion_bd
-        elif descargado and os.path.exists(ruta_esperada):
+        elif self.validar_pdf(ruta_esperada):
             db.marcar_como_descargado(ius, ruta_esperada)
             db.close()
             return True, ruta_esperada
         elif os.path.exists(ruta_esperada):
-            db.marcar_como_descargado(ius, ruta_esperada)
-            db.close()
-            return True, ruta_esperada
-        exito, ruta = self.descargar_tesis(ius, epoca_config)
+            logging.warning(f"PDF de la tesis {ius} inválido en {ruta_esperada}; se descarga de nuevo")
+            try:
+                os.remove(ruta_esperada)
+            except OSError as e:
+                logging.error(f"No se pudo borrar {ruta_esperada}: {e}")
+        exito, ruta, status_http, error = self._descargar_pdf(ius, epoca_config, reintentos)
         if exito:
             db.marcar_como_descargado(ius, ruta)
+        elif not stop_download:
+            # Una descarga cortada por el usuario no cuenta como intento fallido
+            db.registrar_fallo_descarga(ius, status_http, error)
         db.close()
         return exito, ruta
 
     def descargar_todas_pendientes(self, limite: int = None, delay: float = 1.0, reintentos: int = 3,
-                                   incluir_fallidas: bool = False, callback_progreso = None) -> Tuple[int, int, int, int]:
-        db = SCJNTesisDatabase(self.db_path)
-        tesis_pendientes = db.obtener_tesis_por_descargar(limite, incluir_fallidas)
-        total = len(tesis_pendientes)
-        exitos = 0
-        fallos = 0
-        omitidos = 0
-        for i, tesis in enumerate(tesis_pendientes):
-            global stop_download
-            if stop_download:
-                break
-            ius = tesis['ius']
-            epoca_config = tesis['epoca_config']
-            if callback_progreso:
-                callback_progreso(i, total, f"Descargando {ius}... ({i+1}/{total})")
-            exito = False
-            ruta = ""
-            for intento in range(reintentos):
-                try:
-                    if stop_download:
-                        break
-                    exito, ruta = self.descargar_tesis_individual(ius, epoca_config)
-                    if exito:
-                        break
-                    elif intento < reintentos - 1:
-                        time.sleep(delay * 2)
-                except Exception as e:
-                    if intento < reintentos - 1:
-                        time.sleep(delay)
-            if exito:
-                exitos += 1
-            else:
-                fallos += 1
-            time.sleep(delay)
+                                   incluir_fallidas: bool = False, callback_progreso = None,
+                                   workers: int = WORKERS_DESCARGA,
+                                   peticiones_por_segundo_max: float = None) -> Tuple[int, int, int, int]:
+        self.reconciliar_descargas()
+        db = SCJNTesisDatabase.conexion_rapida(self.db_path)
+        # `delay` fija el ritmo inicial y, sin un máximo explícito, también el techo del control AIMD
+        if delay > 0:
+            tasa = 1.0 / delay
+            self.control.fijar_tasa(tasa, peticiones_por_segundo_max or tasa)
+        elif peticiones_por_segundo_max:
+            self.control.fijar_tasa(peticiones_por_segundo_max, peticiones_por_segundo_max)
+        total = db.contar_tesis_por_descargar(incluir_fallidas)
+        if limite:
+            total = min(total, limite)
+        tesis_pendientes = itertools.islice(db.iterar_tesis_por_descargar(incluir_fallidas), limite)
+        motor = MotorDescargas(self, workers=workers, reintentos=reintentos, callback_progreso=callback_progreso)
+        resultado = motor.ejecutar(tesis_pendientes, total)
         db.close()
-        return exitos, fallos, omitidos, total
+        return resultado['exitos'], resultado['fallos'], resultado['omitidos'], resultado['total']
 
     def cerrar(self):
         pass
 
+class MotorDescargas:
+    def __init__(self, descargador: DescargadorTesis, workers: int = WORKERS_DESCARGA, reintentos: int = 3,
+                 callback_progreso: Callable = None, detener: Callable = None):
+        self.descargador = descargador
+        self.workers = max(1, workers)
+        self.reintentos = reintentos
+        self.callback_progreso = callback_progreso
+        self.detener = detener or (lambda: stop_download)
+        obtener_cliente_http(tamano_pool_http(workers_descarga=self.workers))
+        self._lock = threading.Lock()
+        self._ultimo_aviso = 0.0
+        self.estadisticas = {'exitos': 0, 'fallos': 0, 'omitidos': 0, 'procesadas': 0, 'total': 0}
+
+    def ejecutar(self, tesis_pendientes: Iterable[Dict], total: int = None) -> Dict:
+        self.estadisticas['total'] = total if total is not None else len(tesis_pendientes)
+        pendientes = iter(tesis_pendientes)
+        lock_pendientes = threading.Lock()
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            for futuro in [executor.submit(self._trabajador, pendientes, lock_pendientes)
+                           for _ in range(self.workers)]:
+                futuro.result()
+        self._avisar(None, forzar=True)
+        return dict(self.estadisticas)
+
+    def _trabajador(self, pendientes: Iterator[Dict], lock_pendientes: threading.Lock):
+        while not self.detener():
+            with lock_pendientes:
+                tesis = next(pendientes, None)
+            if tesis is None:
+                return
+            exito = self._descargar(tesis['ius'], tesis['epoca_config'])
+            with self._lock:
+                self.estadisticas['exitos' if exito else 'fallos'] += 1
+                self.estadisticas['procesadas'] += 1
+            self._avisar(tesis['ius'])
+
+    def _descargar(self, ius: str, epoca_config: str) -> bool:
+        if self.detener():
+            return False
+        try:
+            exito, _ = self.descargador.descargar_tesis_individual(ius, epoca_config, self.reintentos)
+            return exito
+        except Exception as e:
+            logging.error(f"Error descargando {ius}: {e}")
+            return False
+
+    def _avisar(self, ius: Optional[str], forzar: bool = False):
+        if not self.callback_progreso or self.detener():
+            return
+        with self._lock:
+            ahora = time.monotonic()
+            if not forzar and ahora - self._ultimo_aviso < INTERVALO_PROGRESO_DESCARGA:
+                return
+            self._ultimo_aviso = ahora
+            procesadas, total = self.estadisticas['procesadas'], self.estadisticas['total']
+            mensaje = (f"Descargando {ius}... ({procesadas}/{total}) - {self.workers} hilos - "
+                       f"{self.descargador.control.tasa:.1f} req/s") if ius else f"Descargadas {procesadas}/{total}"
+        self.callback_progreso(procesadas, total, mensaje)
+
+
+class MantenimientoFTS:
+    def __init__(self, db: SCJNTesisDatabase, esta_inactivo, intervalo: float = 60.0, paginas_merge: int = 200):
+        self.db = db
+        self.esta_inactivo = esta_inactivo
+        self.intervalo = intervalo
+        self.paginas_merge = paginas_merge
+        self._detener = threading.Event()
+        self._optimizar = threading.Event()
+        self._hilo = None
+
+    def iniciar(self):
+        if self._hilo is None or not self._hilo.is_alive():
+            self._detener.clear()
+            self._hilo = threading.Thread(target=self._ciclo, daemon=True)
+            self._hilo.start()
+
+    def detener(self):
+        self._detener.set()
+
+    def solicitar_optimizacion(self):
+        self._optimizar.set()
+
+    def _ciclo(self):
+        while not self._detener.wait(self.intervalo):
+            if not self.esta_inactivo():
+                continue
+            try:
+                self._ejecutar()
+            except Exception as e:
+                logging.error(f"Error en mantenimiento FTS: {e}")
+
+    def _ejecutar(self):
+        while not self._detener.is_set() and self.esta_inactivo():
+            if not self.db.fusionar_fts(self.paginas_merge):
+                break
+        if self._optimizar.is_set() and not self._detener.is_set() and self.esta_inactivo():
+            self.db.optimizar_fts()
+            self._optimizar.clear()
+            logging.info("Índice FTS optimizado")
+
+
 def abrir_archivo_con_aplicacion_predeterminada(ruta_archivo: str) -> bool:
     try:
         if os.path.exists(ruta_archivo):
@@ -1360,6 +3072,7 @@ def main(page: ft.Page):
     db = SCJNTesisDatabase(db_path)
     GLOBAL_DB = db 
     listas_manager = ListasManager(data_dir)
+    mantenimiento_fts = MantenimientoFTS(db, lambda: not is_processing_extraccion and not is_processing_descarga)
 
     page.window.maximized = True
     page.title = "Sistema de Gestión de Tesis SCJN"
@@ -1396,6 +3109,8 @@ def main(page: ft.Page):
     bd_version = 0
     last_bd_version = -1
     last_filtros = {"materia": "Todas", "epoca": "Todas", "texto": ""}
+    totales_cache = {}
+    totales_cache_version = None
 
     def on_search_change():
         nonlocal search_debounce_timer
@@ -1414,7 +3129,7 @@ def main(page: ft.Page):
 
     def buscar_tesis_con_filtros(reset_pagination: bool = True):
         nonlocal last_ius, last_fecha, has_more, current_page_tesis
-        nonlocal last_filtros, last_bd_version
+        nonlocal last_filtros, last_bd_version, totales_cache_version
         texto = search_field.value.strip()
         materia = materia_dropdown.value
         epoca = epoca_dropdown.value
@@ -1425,7 +3140,7 @@ def main(page: ft.Page):
             current_page_tesis = []
 
         try:
-            resultados = GLOBAL_DB.obtener_tesis_paginadas_keyset(
+            resultados, has_more = GLOBAL_DB.obtener_tesis_paginadas_keyset(
                 materia=materia,
                 epoca=epoca,
                 texto=texto,
@@ -1443,14 +3158,20 @@ def main(page: ft.Page):
             if resultados:
                 last_ius = resultados[-1]['ius']
                 last_fecha = resultados[-1]['fecha_actualizacion']
-                total_restantes = GLOBAL_DB.contar_tesis_filtradas(materia, epoca, texto, last_ius, last_fecha)
-                has_more = total_restantes > 0
             else:
                 last_ius = None
                 last_fecha = None
-                has_more = False
 
-            total_encontradas = GLOBAL_DB.contar_tesis_filtradas(materia, epoca, texto)
+            # Durante una extracción la base cambia sin que suba bd_version: también cuenta el sello de la base
+            version_actual = (bd_version, GLOBAL_DB.version_datos())
+            if totales_cache_version != version_actual:
+                totales_cache.clear()
+                totales_cache_version = version_actual
+            clave_total = (materia, epoca, texto)
+            total_encontradas = totales_cache.get(clave_total)
+            if total_encontradas is None:
+                total_encontradas = GLOBAL_DB.contar_tesis_filtradas(materia, epoca, texto)
+                totales_cache[clave_total] = total_encontradas
             titulo = f"Tesis encontradas: {total_encontradas}"
             if has_more:
                 titulo += " (cargadas primeras 50)"
@@ -1895,7 +3616,7 @@ def main(page: ft.Page):
             metricas = [
                 ("Total", str(stats['total_tesis']), ft.Colors.BLUE_700),
                 ("Descargadas", str(stats.get('tesis_descargadas', 0)), ft.Colors.GREEN_700),
-                ("Pendientes", str(stats['total_tesis'] - stats.get('tesis_descargadas', 0)), ft.Colors.ORANGE_700),
+                ("Pendientes", str(stats['tesis_pendientes']), ft.Colors.ORANGE_700),
                 ("Última Actualización", stats['ultima_actualizacion'][:10] if stats['ultima_actualizacion'] else "N/A", ft.Colors.PURPLE_700),
             ]
             for titulo, valor, color in metricas:
@@ -2581,12 +4302,11 @@ def main(page: ft.Page):
         def extraccion_background():
             nonlocal is_processing_extraccion, current_view, bd_version
             global stop_extraction
+            extractor = None
             try:
                 extractor = SCJNTesisExtractor(GLOBAL_DB_PATH)
-                total_combinaciones = len(extractor.configuraciones_epocas) * len(extractor.tipos_tesis)
-                combinacion_actual = 0
 
-                def callback_progreso(pagina_actual, max_paginas, mensaje, progreso_general=None):
+                def callback_progreso(completadas, total, mensaje, progreso_general=None):
                     if stop_extraction:
                         return None
                     if progreso_general is not None:
@@ -2595,33 +4315,14 @@ def main(page: ft.Page):
                         page.run_thread(lambda: actualizar_progreso_estadisticas(mensaje, ""))
                     return True
 
-                for epoca_nombre in extractor.configuraciones_epocas.keys():
-                    if stop_extraction:
-                        break
-                    for tipo_nombre in extractor.tipos_tesis.keys():
-                        if stop_extraction:
-                            break
-                        combinacion_actual += 1
-                        epoca_actual = epoca_nombre.replace('_', ' ')
-                        tipo_actual = tipo_nombre
-                        combo_actual = combinacion_actual
-                        total_combo = total_combinaciones
-                        page.run_thread(lambda: actualizar_progreso_estadisticas(
-                            f"Extrayendo {epoca_actual} - {tipo_actual}... ({combo_actual}/{total_combo})",
-                            f"Iniciando extracción..."
-                        ))
-                        extractor.procesar_epoca_tipo(
-                            epoca=epoca_nombre,
-                            tipo_tesis=tipo_nombre,
-                            size=50,
-                            max_paginas=1000,
-                            combinacion_actual=combinacion_actual,
-                            total_combinaciones=total_combinaciones,
-                            callback_progreso=callback_progreso
-                        )
-                        if stop_extraction:
-                            break
-                        time.sleep(1)
+                page.run_thread(lambda: actualizar_progreso_estadisticas(
+                    "Extrayendo todas las épocas y tipos en paralelo...", "Iniciando extracción..."
+                ))
+                extractor.extraer_todas_epocas_y_tipos(
+                    size=50,
+                    max_paginas_por_consulta=1000,
+                    callback_progreso=callback_progreso
+                )
 
                 if stop_extraction:
                     page.run_thread(lambda: actualizar_progreso_estadisticas("Extracción detenida", "Proceso interrumpido por el usuario"))
@@ -2631,6 +4332,7 @@ def main(page: ft.Page):
                     page.run_thread(lambda: actualizar_estado("Extracción completada exitosamente"))
 
                 page.run_thread(lambda: incrementar_bd_version())
+                mantenimiento_fts.solicitar_optimizacion()
 
                 if current_view == "estadisticas":
                     page.run_thread(mostrar_estadisticas)
@@ -2643,6 +4345,8 @@ def main(page: ft.Page):
                 page.run_thread(lambda: actualizar_estado("Error en extracción", error_msg))
 
             finally:
+                if extractor:
+                    extractor.cerrar()
                 is_processing_extraccion = False
                 stop_extraction = False
                 page.run_thread(lambda: setattr(extraer_todas_btn_estadisticas, 'disabled', False))
@@ -2658,8 +4362,7 @@ def main(page: ft.Page):
         if is_processing_extraccion or is_processing_descarga:
             actualizar_estado("Ya hay un proceso en ejecución")
             return
-        stats = GLOBAL_DB.obtener_estadisticas()
-        tesis_pendientes = stats['total_tesis'] - stats.get('tesis_descargadas', 0)
+        tesis_pendientes = GLOBAL_DB.contar_tesis_pendientes()
         if tesis_pendientes == 0:
             return
         global stop_download, descargador_thread
@@ -2678,11 +4381,12 @@ def main(page: ft.Page):
             global stop_download
             is_processing_descarga = True
             try:
-                db_thread = SCJNTesisDatabase(GLOBAL_DB_PATH)
-                tesis_pendientes_list = db_thread.obtener_tesis_por_descargar(limite=None, incluir_fallidas=False)
-                db_thread.close()
-                total = len(tesis_pendientes_list)
+                actualizar_progreso_estadisticas("Revisando PDFs ya descargados...", "")
+                DescargadorTesis(GLOBAL_DB_PATH).reconciliar_descargas()
+                db_thread = SCJNTesisDatabase.conexion_rapida(GLOBAL_DB_PATH)
+                total = db_thread.contar_tesis_por_descargar()
                 if total == 0:
+                    db_thread.close()
                     extraer_todas_btn_estadisticas.disabled = False
                     descargar_pdfs_btn_estadisticas.disabled = False
                     detener_descarga_btn.visible = False
@@ -2692,29 +4396,15 @@ def main(page: ft.Page):
                     page.update()
                     return
                 descargador = DescargadorTesis(GLOBAL_DB_PATH)
-                exitos = 0
-                fallos = 0
                 def callback_progreso(actual, total_tesis, mensaje):
                     if stop_download:
                         return
                     page.run_thread(lambda: actualizar_progreso_estadisticas(mensaje, f"Progreso: {actual}/{total_tesis} ({actual/total_tesis*100:.1f}%)"))
-                for i, tesis in enumerate(tesis_pendientes_list):
-                    if stop_download:
-                        break
-                    ius = tesis['ius']
-                    epoca_config = tesis['epoca_config']
-                    callback_progreso(i+1, total, f"Descargando {ius}... ({i+1}/{total})")
-                    try:
-                        exito, _ = descargador.descargar_tesis_individual(ius, epoca_config)
-                        if exito:
-                            exitos += 1
-                        else:
-                            fallos += 1
-                    except Exception as e:
-                        fallos += 1
-                        logging.error(f"Error descargando {ius}: {e}")
-                    if not stop_download:
-                        time.sleep(1)
+                motor = MotorDescargas(descargador, callback_progreso=callback_progreso)
+                resultado = motor.ejecutar(db_thread.iterar_tesis_por_descargar(), total)
+                db_thread.close()
+                exitos = resultado['exitos']
+                fallos = resultado['fallos']
                 if stop_download:
                     actualizar_progreso_estadisticas("Descarga detenida", "Proceso interrumpido por el usuario")
                     actualizar_estado("Descarga detenida")
@@ -2774,12 +4464,13 @@ def main(page: ft.Page):
         def procesar_tesis():
             nonlocal bd_version
             actualizar_estado(f"Procesando tesis {ius}...", "Verificando si ya está descargada")
-            db_thread = SCJNTesisDatabase(GLOBAL_DB_PATH)
+            db_thread = SCJNTesisDatabase.conexion_rapida(GLOBAL_DB_PATH)
             descargado, ubicacion = db_thread.verificar_estado_descarga(ius)
             descargador = DescargadorTesis(GLOBAL_DB_PATH)
             carpeta_epoca = descargador.obtener_carpeta_epoca(epoca_config)
             ruta_esperada = os.path.join(carpeta_epoca, f"tesis_{ius}.pdf")
-            if descargado and ubicacion and os.path.exists(ubicacion):
+            # Un PDF truncado no se abre: descargar_tesis_individual lo borra y lo baja de nuevo
+            if descargado and ubicacion and descargador.validar_pdf(ubicacion):
                 db_thread.close()
                 exito = abrir_archivo_con_aplicacion_predeterminada(ubicacion)
                 if exito:
@@ -2787,17 +4478,7 @@ def main(page: ft.Page):
                 else:
                     actualizar_estado(f"Error al abrir el archivo", "Verifique que tenga una aplicación para abrir PDFs")
                 return
-            elif descargado and os.path.exists(ruta_esperada):
-                db_thread.marcar_como_descargado(ius, ruta_esperada)
-                db_thread.close()
-                exito = abrir_archivo_con_aplicacion_predeterminada(ruta_esperada)
-                if exito:
-                    actualizar_estado(f"PDF abierto: {os.path.basename(ruta_esperada)}")
-                else:
-                    actualizar_estado(f"Error al abrir el archivo", "Verifique que tenga una aplicación para abrir PDFs")
-                page.run_thread(incrementar_bd_version)
-                return
-            elif os.path.exists(ruta_esperada):
+            elif descargador.validar_pdf(ruta_esperada):
                 db_thread.marcar_como_descargado(ius, ruta_esperada)
                 db_thread.close()
                 exito = abrir_archivo_con_aplicacion_predeterminada(ruta_esperada)
@@ -2877,15 +4558,50 @@ def main(page: ft.Page):
 
     refresh_dropdowns()
     cargar_ultimas_tesis()
+    mantenimiento_fts.iniciar()
 
     def on_close(e):
         global stop_extraction, stop_download
         stop_extraction = True
         stop_download = True
+        mantenimiento_fts.detener()
         if GLOBAL_DB:
             GLOBAL_DB.close()
+        cerrar_capas_bd()
         os._exit(0)
     page.on_close = on_close
 
 if __name__ == "__main__":
-    ft.run(main)
\ No newline at end of file
+    if "--reconstruir-resumenes" in sys.argv:
+        db = SCJNTesisDatabase(ensure_db_in_data(get_data_folder()))
+        db.reconstruir_resumenes()
+        db.close()
+        cerrar_capas_bd()
+    elif "--reconstruir-desde-cache" in sys.argv:
+        extractor = SCJNTesisExtractor(ensure_db_in_data(get_data_folder()))
+        resultado = extractor.reconstruir_desde_cache(
+            callback_progreso=lambda actual, total, mensaje, progreso=None: print(mensaje) or True
+        )
+        print(f"Reconstrucción desde caché: {resultado['total_tesis_nuevas']} nuevas, "
+              f"{resultado['total_detalles_actualizados']} detalles reescritos")
+        extractor.cerrar()
+        cerrar_capas_bd()
+    elif "--reconciliar-descargas" in sys.argv:
+        db = SCJNTesisDatabase(ensure_db_in_data(get_data_folder()))
+        resultado = DescargadorTesis(db.db_path).reconciliar_descargas(validar="--validar" in sys.argv)
+        print(f"Reconciliación: {resultado['archivos']} PDFs en disco, {resultado['registradas']} registradas, "
+              f"{resultado['perdidas']} marcadas como no descargadas, {resultado['invalidas']} PDFs inválidos borrados")
+        db.close()
+        cerrar_capas_bd()
+    elif "--sincronizar" in sys.argv:
+        extractor = SCJNTesisExtractor(ensure_db_in_data(get_data_folder()))
+        resultado = extractor.extraer_todas_epocas_y_tipos(
+            modo_sync=True,
+            callback_progreso=lambda actual, total, mensaje, progreso=None: print(mensaje) or True
+        )
+        print(f"Sincronización: {resultado['total_tesis_nuevas']} nuevas, "
+              f"{resultado['total_tesis_existentes']} actualizadas, {resultado['total_tesis_sin_cambios']} sin cambios")
+        extractor.cerrar()
+        cerrar_capas_bd()
+    else:
+        ft.run(main)
\ No newline at end of file